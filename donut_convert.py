@@ -1,69 +1,84 @@
 import json
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib json module
+    orjson = None
+
 # === Input & Output Paths ===
 input_json = Path("label_studio_test.json")
 output_json = Path("donut_finetune_ready.json")
 
 # === Load Label Studio JSON ===
-with open(input_json, "r", encoding="utf-8") as f:
-    label_studio_data = json.load(f)
+if orjson is not None:
+    label_studio_data = orjson.loads(input_json.read_bytes())
+else:
+    with open(input_json, "r", encoding="utf-8") as f:
+        label_studio_data = json.load(f)
 
 # === Convert to Donut Format ===
 donut_dataset = []
 
 for task in label_studio_data:
     image_path = task["data"]["image"].split("/")[-1]
-    page_annotations = []
 
     # Maps for annotation info
     bbox_map = {}     # id → bounding box with label
-    text_map = {}     # id → textarea values (if not already attached)
     relations = []    # list of relations
 
+    # Group results by type once, so each kind gets its own branch-free loop
+    items_by_type = {"rectanglelabels": [], "textarea": [], "relation": []}
     for item in task["annotations"][0]["result"]:
-        item_type = item.get("type")
+        group = items_by_type.get(item.get("type"))
+        if group is not None:
+            group.append(item)
 
-        # --- Rectangle labels (bounding boxes) ---
-        if item_type == "rectanglelabels" and "id" in item:
-            item_id = item["id"]
-            label = item["value"]["rectanglelabels"][0]
-            bbox_map[item_id] = {
-                "label": label,
-                "bbox": {
-                    "x": item["value"]["x"],
-                    "y": item["value"]["y"],
-                    "width": item["value"]["width"],
-                    "height": item["value"]["height"],
-                },
-                "text": ""  # Placeholder, might be updated later
-            }
+    # --- Rectangle labels (bounding boxes) ---
+    for item in items_by_type["rectanglelabels"]:
+        if "id" not in item:
+            continue
+        item_id = item["id"]
+        val = item["value"]
+        label = val["rectanglelabels"][0]
+        bbox_map[item_id] = {
+            "label": label,
+            "bbox": {
+                "x": val["x"],
+                "y": val["y"],
+                "width": val["width"],
+                "height": val["height"],
+            },
+        }  # "text" is only set once a matching textarea is seen
 
-        # --- Text attached to region ---
-        elif item_type == "textarea" and "id" in item:
-            item_id = item["id"]
-            text_content = item["value"]["text"][0] if isinstance(item["value"]["text"], list) else item["value"]["text"]
-            if item_id in bbox_map:
-                bbox_map[item_id]["text"] = text_content
-            else:
-                text_map[item_id] = text_content
+    # --- Text attached to region ---
+    for item in items_by_type["textarea"]:
+        if "id" not in item:
+            continue
+        item_id = item["id"]
+        text_val = item["value"]["text"]
+        text_content = text_val[0] if type(text_val) is list else text_val  # Label Studio emits a list
+        if item_id in bbox_map:  # Rectangles are all indexed first, so textarea order does not matter
+            bbox_map[item_id]["text"] = text_content
 
-        # --- Relationships ---
-        elif item_type == "relation":
-            relations.append({
-                "from": item["from_id"],
-                "to": item["to_id"],
-                "type": item["labels"][0] if "labels" in item and item["labels"] else ""
-            })
+    # --- Relationships ---
+    for item in items_by_type["relation"]:
+        relations.append({
+            "from": item["from_id"],
+            "to": item["to_id"],
+            "type": item["labels"][0] if "labels" in item and item["labels"] else ""
+        })
 
     # --- Assemble Annotation List ---
-    for obj_id, data in bbox_map.items():
-        page_annotations.append({
+    page_annotations = [
+        {
             "label": data["label"],
             "text": data.get("text", ""),
             "bbox": data["bbox"],
             "id": obj_id
-        })
+        }
+        for obj_id, data in bbox_map.items()
+    ]
 
     # --- Build Final JSON for this page ---
     donut_item = {
@@ -75,7 +90,10 @@ for task in label_studio_data:
     donut_dataset.append(donut_item)
 
 # === Save to Donut Format JSON ===
-with open(output_json, "w", encoding="utf-8") as f:
-    json.dump(donut_dataset, f, ensure_ascii=False, indent=2)
+if orjson is not None:
+    output_json.write_bytes(orjson.dumps(donut_dataset, option=orjson.OPT_INDENT_2))
+else:
+    with open(output_json, "w", encoding="utf-8") as f:
+        json.dump(donut_dataset, f, ensure_ascii=False, indent=2)
 
 print(f"✅ Converted file saved to: {output_json}")
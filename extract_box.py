@@ -1,15 +1,29 @@
 import zipfile
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
 import os
 import argparse
-import shutil
-import tempfile
 import re
 import math
+import functools
+import collections
+import concurrent.futures
+import contextlib
+import io
+import logging
+import sys
+
+import numpy as np
+
+# Per-item tracing is logged at DEBUG (enable with --verbose); messages use lazy
+# %-formatting so disabled traces cost no string building.
+logger = logging.getLogger(__name__)
 
 # --- Helper Functions for Geometry and Transforms (mostly from previous version) ---
 
 
+# Both parsers are pure functions of short attribute strings that repeat heavily
+# (identity transforms in particular), so results are memoized per raw string.
+@functools.lru_cache(maxsize=8192)
 def parse_transform_matrix(transform_str):
     if not transform_str:
         return (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
@@ -19,12 +33,14 @@ def parse_transform_matrix(transform_str):
             return tuple(parts)
     except ValueError:
         pass
-    print(
-        f"⚠️ Warning: Could not parse transform string: '{transform_str}'. Using identity."
+    logger.warning(
+        "⚠️ Warning: Could not parse transform string: '%s'. Using identity.",
+        transform_str,
     )
     return (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
 
 
+@functools.lru_cache(maxsize=8192)
 def parse_geometric_bounds(bounds_str):
     if not bounds_str:
         return (0.0, 0.0, 0.0, 0.0)
@@ -34,24 +50,13 @@ def parse_geometric_bounds(bounds_str):
             return tuple(parts)  # y1, x1, y2, x2
     except ValueError:
         pass
-    print(
-        f"⚠️ Warning: Could not parse geometric bounds: '{bounds_str}'. Using zero bounds."
+    logger.warning(
+        "⚠️ Warning: Could not parse geometric bounds: '%s'. Using zero bounds.",
+        bounds_str,
     )
     return (0.0, 0.0, 0.0, 0.0)
 
 
-def multiply_matrices(m1, m2):
-    a1, b1, c1, d1, tx1, ty1 = m1
-    a2, b2, c2, d2, tx2, ty2 = m2
-    a_res = a1 * a2 + c1 * b2
-    b_res = b1 * a2 + d1 * b2
-    c_res = a1 * c2 + c1 * d2
-    d_res = b1 * c2 + d1 * d2
-    tx_res = a1 * tx2 + c1 * ty2 + tx1
-    ty_res = b1 * tx2 + d1 * ty2 + ty1
-    return (a_res, b_res, c_res, d_res, tx_res, ty_res)
-
-
 def apply_transform_to_point(x, y, matrix):
     a, b, c, d, tx, ty = matrix
     new_x = a * x + c * y + tx
@@ -72,27 +77,64 @@ def get_global_corners(local_bounds, global_item_matrix):
 
 
 def get_axis_aligned_bounding_box(corners):
-    """Calculates the axis-aligned bounding box from a list of corner points."""
+    """Calculates the (x1, y1, x2, y2) axis-aligned bounding box of corner points."""
     if not corners:
-        return {"x1": 0, "y1": 0, "x2": 0, "y2": 0}
+        return (0.0, 0.0, 0.0, 0.0)
     all_x = [p[0] for p in corners]
     all_y = [p[1] for p in corners]
-    return {"x1": min(all_x), "y1": min(all_y), "x2": max(all_x), "y2": max(all_y)}
+    return (min(all_x), min(all_y), max(all_x), max(all_y))
+
+
+# Batched item geometry is kept in single precision: IDML coordinates are small
+# enough that float32 is ample for AABBs and page assignment. Values are turned
+# back into Python floats before they are reported.
+GEOMETRY_DTYPE = np.float32
 
 
-def get_item_center(global_aabb):
-    """Calculates the center of an axis-aligned bounding box."""
+def affine_to_array(matrix):
+    """Converts an (a, b, c, d, tx, ty) transform into its 3x3 homogeneous form."""
+    a, b, c, d, tx, ty = matrix
+    return ((a, c, tx), (b, d, ty), (0.0, 0.0, 1.0))
+
+
+def multiply_matrices(m1, m2):
+    """Composes 3x3 homogeneous transforms (single or stacked as (N, 3, 3))."""
+    return m1 @ m2
+
+
+def get_global_corners_batch(local_bounds, global_item_matrices):
+    """Calculates the four corner points of N items as an (N, 4, 2) array.
+
+    local_bounds is an (N, 4) array of (y1, x1, y2, x2) rows, matrices are (N, 3, 3).
+    Corner order matches get_global_corners.
+    """
+    y1, x1, y2, x2 = local_bounds.T
+    corners = np.stack([x1, y1, x2, y1, x1, y2, x2, y2], axis=1).reshape(-1, 4, 2)
     return (
-        (global_aabb["x1"] + global_aabb["x2"]) / 2.0,
-        (global_aabb["y1"] + global_aabb["y2"]) / 2.0,
+        np.einsum("nij,nkj->nki", global_item_matrices[:, :2, :2], corners)
+        + global_item_matrices[:, None, :2, 2]
     )
 
 
-def is_point_in_rect(px, py, rect_y1, rect_x1, rect_y2, rect_x2):
-    return (rect_x1 <= px <= rect_x2) and (rect_y1 <= py <= rect_y2)
+def get_axis_aligned_bounding_boxes(corners):
+    """Calculates (N, 4) rows of (x1, y1, x2, y2) from (N, 4, 2) corner points."""
+    return np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+
+
+_LOCAL_TAG_NAMES = {}  # Full "{ns}Tag" -> "Tag"
+
+
+def local_tag_name(tag):
+    """Strips the namespace from an element tag, splitting each distinct tag once."""
+    name = _LOCAL_TAG_NAMES.get(tag)
+    if name is None:
+        name = _LOCAL_TAG_NAMES[tag] = tag.split("}")[-1]
+    return name
 
 
 class PageGeometricInfo:
+    __slots__ = ("id", "name", "matrix", "local_bounds", "global_aabb")
+
     def __init__(self, self_id, name, page_matrix_str, page_bounds_str):
         self.id = self_id
         self.name = name
@@ -105,42 +147,91 @@ class PageGeometricInfo:
         page_global_corners = get_global_corners(self.local_bounds, self.matrix)
         self.global_aabb = get_axis_aligned_bounding_box(
             page_global_corners
-        )  # Stored as {"x1":val, ...}
-
-        print(
-            f"<<  Page '{self.name}' (ID: {self.id}): \npage_bounds_str = {page_bounds_str}"
-            f"Global AABB=(x1: {self.global_aabb['x1']:.2f} x2: {self.global_aabb['x2']:.2f}, "
-            f"y1: {self.global_aabb['y1']:.2f} y2: {self.global_aabb['y2']:.2f})  >>\n"
+        )  # Stored as an (x1, y1, x2, y2) tuple
+
+        x1, y1, x2, y2 = self.global_aabb
+        logger.debug(
+            "<<  Page '%s' (ID: %s): \npage_bounds_str = %s"
+            "Global AABB=(x1: %.2f x2: %.2f, y1: %.2f y2: %.2f)  >>\n",
+            self.name,
+            self.id,
+            page_bounds_str,
+            x1,
+            x2,
+            y1,
+            y2,
         )
 
 
-# --- Main Extraction Logic --- (extract_idml, get_story_text are same)
-def extract_idml(idml_path, extract_to):
-    try:
-        with zipfile.ZipFile(idml_path, "r") as zip_ref:
-            zip_ref.extractall(extract_to)
-        print(f"✅ Successfully extracted IDML to {extract_to}")
-        return True
-    except Exception as e:
-        print(f"❌ Extraction failed: {e}")
-        return False
+# Comments and processing instructions are dropped so every child in the spread
+# tree is a real element with a string tag.
+SPREAD_PARSER = ET.XMLParser(remove_comments=True, remove_pis=True)
+
+# Compiled once at import. IDML content elements carry no namespace (only the
+# idPkg:* package wrappers do), so plain name tests match exactly what the old
+# "{*}" paths matched, without a local-name() predicate evaluated on every node.
+# Each returns a list of matches in document order.
+XP_GRAPHIC_BOUNDS = ET.XPath(".//Properties/GraphicBounds")
+XP_LINK = ET.XPath(".//Link")
+XP_PAGE = ET.XPath(".//Page")
+
+
+# --- Main Extraction Logic --- (open_idml, get_story_text are same)
+SPREADS_PREFIX = "Spreads/"
+STORIES_PREFIX = "Stories/"
+
+
+# This script runs once per package from the command line, so each process
+# (a pool worker, or main for a single spread) keeps its handle until it exits.
+@functools.lru_cache(maxsize=None)
+def open_idml(idml_path):
+    """The package's ZipFile; spreads and stories are parsed from its member streams."""
+    return zipfile.ZipFile(idml_path, "r")
+
+
+@functools.lru_cache(maxsize=None)
+def idml_story_paths(idml_path):
+    """Maps story ids to their Story_<id>.xml members, from one scan of the package listing."""
+    prefix = STORIES_PREFIX + "Story_"
+    return {
+        sys.intern(name[len(prefix) : -len(".xml")]): name
+        for name in open_idml(idml_path).namelist()
+        if name.startswith(prefix) and name.endswith(".xml")
+    }
 
 
-def get_story_text(story_path):
+def release_element(element):
+    """Drops a Content/Br element once its text is taken, and the story elements read before it."""
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+
+# \s also matches "\n", so one pass collapses every whitespace run that holds a
+# newline (blank lines included) down to a single "\n".
+_RE_WS_NL = re.compile(r"\s*\n\s*")
+
+
+# Stories are shared between text frames (and spreads), so each file is parsed once.
+@functools.lru_cache(maxsize=None)
+def get_story_text(idml_path, story_path):
     text_content_segments = []
     try:
-        tree = ET.parse(story_path)
-        root = tree.getroot()
-        for element in root.iter():
-            tag_name = element.tag.split("}")[-1]
-            if tag_name == "Content":
-                if element.text:
-                    text_content_segments.append(element.text)
-            elif tag_name == "Br":
-                text_content_segments.append("\n")
+        # Stream the story instead of building its whole tree. libxml2 filters for
+        # Content/Br itself, so only those two tags reach Python, and each is
+        # released (with its already-read siblings) once handled.
+        with open_idml(idml_path).open(story_path) as story_file:
+            for _, element in ET.iterparse(
+                story_file, events=("end",), tag=("Content", "Br")
+            ):
+                if element.tag == "Content":
+                    if element.text:
+                        text_content_segments.append(element.text)
+                else:
+                    text_content_segments.append("\n")
+                release_element(element)
         full_text = "".join(text_content_segments)
-        full_text = re.sub(r"\s*\n\s*", "\n", full_text)
-        full_text = re.sub(r"\n{2,}", "\n", full_text).strip()
+        full_text = _RE_WS_NL.sub("\n", full_text).strip()
         # Keep logging minimal here, focus on spread processing logs
         # if not full_text:
         #     print(f"    ℹ️ No text content found in story: {os.path.basename(story_path)}")
@@ -154,102 +245,228 @@ def get_story_text(story_path):
     return ""
 
 
-def find_page_for_item_center(item_center_x, item_center_y, geometric_pages):
-    """Finds which page an item's center point falls into."""
-    for page_info in geometric_pages:
-        if is_point_in_rect(
-            item_center_x,
-            item_center_y,
-            page_info.global_aabb["y1"],
-            page_info.global_aabb["x1"],
-            page_info.global_aabb["y2"],
-            page_info.global_aabb["x2"],
-        ):
-            return page_info.id
-    return None
-
+CONTAINER_TAGS = frozenset({"Group", "Rectangle", "Oval", "Polygon"})
+CONTENT_TAGS = frozenset({"Image", "TextFrame"})
+SKIPPED_SPREAD_CHILD_TAGS = frozenset({"Page", "FlattenerPreference", "Properties"})
 
-# Modified function signature
-def process_spread_element_recursively(
-    element,
-    parent_element,
-    current_accumulated_matrix,
-    geometric_pages,
-    pages_content_map,
-    stories_dir,
-    story_cache,
-    depth=0,
-):
-    indent = "  " * (depth + 2)
-    element_tag_local = element.tag.split("}")[-1]
-    element_id = element.get("Self", "UnknownID")
 
-    item_local_matrix_str = element.get("ItemTransform")
-    item_local_matrix = parse_transform_matrix(item_local_matrix_str)
-    item_global_matrix = multiply_matrices(
-        current_accumulated_matrix, item_local_matrix
-    )
+def get_item_local_bounds(element, element_tag_local, indent=""):
+    """Returns an item's local (y1, x1, y2, x2) bounds."""
     # For <Image> there is no 'GeometricBounds' property, however can be found in <Properties> -> <GraphicBounds Left="0" Top="0" Right="961.92" Bottom="1442.88"/>
-    # print(f"+++ element tag local = {element_tag_local}")
     if element_tag_local == "Image":
-        graphic_bounds_prop = element.find(
-            ".//{*}Properties/{*}GraphicBounds"
-        )  # Relative XPath to find GraphicBounds
-        if graphic_bounds_prop is not None:
+        graphic_bounds_matches = XP_GRAPHIC_BOUNDS(element)
+        if graphic_bounds_matches:
+            graphic_bounds_prop = graphic_bounds_matches[0]
             try:
                 gb_left = float(graphic_bounds_prop.get("Left", "0"))
                 gb_top = float(graphic_bounds_prop.get("Top", "0"))
                 gb_right = float(graphic_bounds_prop.get("Right", "0"))
                 gb_bottom = float(graphic_bounds_prop.get("Bottom", "0"))
                 # Override actual_local_bounds with GraphicBounds values
-                item_local_bounds = (gb_top, gb_left, gb_bottom, gb_right)
+                return (gb_top, gb_left, gb_bottom, gb_right)
             except (ValueError, TypeError) as e:
-                print(
-                    f"{indent}⚠️ Error parsing GraphicBounds for Image ID: {element_id} - {e}. Attributes: {graphic_bounds_prop.attrib}"
+                element_id = element.get("Self", "UnknownID")
+                logger.warning(
+                    "%s⚠️ Error parsing GraphicBounds for Image ID: %s - %s. Attributes: %s",
+                    indent,
+                    element_id,
+                    e,
+                    graphic_bounds_prop.attrib,
                 )
         # else: # Optional: for debugging if GraphicBounds tag itself is not found
         # print(f"{indent}ℹ️ Image ID: {element_id} did not find GraphicBounds element under Properties.")
-    else:
-        item_local_bounds_str = element.get("GeometricBounds")
-        item_local_bounds = parse_geometric_bounds(
-                item_local_bounds_str
-            )  # y1, x1, y2, x2
-
-    # item_global_aabb = {"x1": 0.0, "y1": 0.0, "x2": 0.0, "y2": 0.0}
-    # item_center_x, item_center_y = item_global_matrix[4], item_global_matrix[5] # Default to transformed origin
-
-    ##
-
-    item_global_corners = []
-    item_global_aabb = {
-        "x1": 0.0,
-        "y1": 0.0,
-        "x2": 0.0,
-        "y2": 0.0,
-    }  # Ensure float for consistency
-    # item_center_x, item_center_y = 0.0, 0.0 # Initialize as float
-    item_center_x, item_center_y = (
-        item_global_matrix[4],
-        item_global_matrix[5],
-    )  # Default to transformed origin
-    # print(f'-------- item center x == {item_center_x}  item center y == {item_center_y}')
-    # Calculate global corners and AABB
-    if item_local_bounds != (0.0, 0.0, 0.0, 0.0) or element_tag_local in ["Group"]:
-        item_global_corners = get_global_corners(item_local_bounds, item_global_matrix)
-        item_global_aabb = get_axis_aligned_bounding_box(item_global_corners)
-        # *** This is where item_center_x and item_center_y should be defined ***
-        item_center_x, item_center_y = get_item_center(item_global_aabb)
-
-    # Now item_center_x and item_center_y are defined before being used
-    assigned_page_id = find_page_for_item_center(
-        item_center_x, item_center_y, geometric_pages
+        return (0.0, 0.0, 0.0, 0.0)
+    return parse_geometric_bounds(element.get("GeometricBounds"))  # y1, x1, y2, x2
+
+
+def flatten_spread_items(spread_element):
+    """Walks the spread's item tree depth-first, in document order.
+
+    Uses an explicit stack rather than recursion, so deeply nested Groups cannot hit
+    the interpreter's recursion limit. Only containers and content items (Image,
+    TextFrame) are kept. Returns a list of (element, parent_element,
+    element_tag_local, parent_index, depth) records, where parent_index is -1 for
+    direct children of the spread.
+    """
+    items = []
+    stack = collections.deque(
+        (child_el, spread_element, -1, 0)
+        for child_el in reversed(spread_element)
+        if local_tag_name(child_el.tag) not in SKIPPED_SPREAD_CHILD_TAGS
+    )  # Skip already processed or non-content metadata
+    while stack:
+        element, parent_element, parent_index, depth = stack.pop()
+        element_tag_local = local_tag_name(element.tag)
+        if element_tag_local in CONTAINER_TAGS:
+            index = len(items)
+            stack.extend(
+                (child_element, element, index, depth + 1)
+                for child_element in reversed(element)
+            )
+        elif element_tag_local not in CONTENT_TAGS:
+            continue
+        items.append((element, parent_element, element_tag_local, parent_index, depth))
+    return items
+
+
+def compute_items_geometry(items, spread_base_matrix):
+    """Computes global AABBs and centers for all flattened spread items in one batch.
+
+    Returns an (N, 4) array of (x1, y1, x2, y2) boxes and an (N, 2) array of centers.
+    Items without local bounds (other than Groups) get a zero box and are centered
+    on their transformed origin.
+    """
+    local_matrices = np.array(
+        [
+            affine_to_array(parse_transform_matrix(item[0].get("ItemTransform")))
+            for item in items
+        ],
+        dtype=GEOMETRY_DTYPE,
+    ).reshape(-1, 3, 3)
+    local_bounds = np.array(
+        [
+            get_item_local_bounds(item[0], item[2], "  " * (item[4] + 2))
+            for item in items
+        ],
+        dtype=GEOMETRY_DTYPE,
+    ).reshape(-1, 4)
+    parent_indices = np.array([item[3] for item in items], dtype=np.intp)
+    depths = np.array([item[4] for item in items], dtype=np.intp)
+
+    # The extra last row holds the spread's base matrix, so parent_index -1 picks it up.
+    global_matrices = np.empty((len(items) + 1, 3, 3), dtype=GEOMETRY_DTYPE)
+    global_matrices[-1] = affine_to_array(spread_base_matrix)
+    for depth in range(int(depths.max(initial=-1)) + 1):
+        level = np.flatnonzero(depths == depth)
+        global_matrices[level] = multiply_matrices(
+            global_matrices[parent_indices[level]], local_matrices[level]
+        )
+    global_matrices = global_matrices[:-1]
+
+    corners = get_global_corners_batch(local_bounds, global_matrices)
+    global_aabbs = get_axis_aligned_bounding_boxes(corners)
+    has_bounds = local_bounds.any(axis=1) | np.array(
+        [item[2] == "Group" for item in items], dtype=bool
+    )
+    global_aabbs[~has_bounds] = 0.0
+    centers = np.where(
+        has_bounds[:, None],
+        (global_aabbs[:, :2] + global_aabbs[:, 2:]) / 2.0,
+        global_matrices[:, :2, 2],  # Default to transformed origin
     )
+    return global_aabbs, centers
+
+
+def assign_items_to_pages(item_centers, geometric_pages):
+    """Assigns each item center to the first page whose global AABB contains it.
+
+    The containment test runs as one (N_items, N_pages) boolean matrix. Returns a
+    list of page ids, with None for items whose center falls on no page.
+    """
+    page_rects = np.array(
+        [page_info.global_aabb for page_info in geometric_pages], dtype=GEOMETRY_DTYPE
+    ).reshape(-1, 4)
+    cx = item_centers[:, 0:1]
+    cy = item_centers[:, 1:2]
+    inside = (
+        (cx >= page_rects[:, 0])
+        & (cx <= page_rects[:, 2])
+        & (cy >= page_rects[:, 1])
+        & (cy <= page_rects[:, 3])
+    )
+    first_hit = inside.argmax(axis=1)
+    hit_any = inside.any(axis=1)
+    page_ids = [page_info.id for page_info in geometric_pages]
+    return [
+        page_ids[page_idx] if hit else None
+        for page_idx, hit in zip(first_hit.tolist(), hit_any.tolist())
+    ]
+
+
+def new_page_content(name):
+    """Creates an empty per-page record.
+
+    Images and texts are stored column-wise: each field is its own list, and the
+    i-th entry of every list describes the same item. Bounds are (x1, y1, x2, y2).
+    """
+    return {
+        "name": name,
+        "images": {
+            "uris": [],
+            "elem_ids": [],
+            "container_tags": [],
+            "container_ids": [],
+            "bounds": [],
+            "transforms": [],
+        },
+        "texts": {
+            "story_ids": [],
+            "frame_ids": [],
+            "contents": [],
+            "bounds": [],
+            "transforms": [],
+        },
+        # Dedup keys for images/texts, kept alongside the ordered columns
+        "image_keys": set(),
+        "text_frame_ids": set(),
+    }
+
+
+def add_page_image(
+    page_data, uri, elem_id, container_tag, container_id, bounds, transform
+):
+    """Appends an image to page_data unless its (uri, elem_id) is already there."""
+    image_key = (uri, elem_id)
+    if image_key in page_data["image_keys"]:
+        return False
+    page_data["image_keys"].add(image_key)
+    images = page_data["images"]
+    images["uris"].append(uri)
+    images["elem_ids"].append(elem_id)
+    images["container_tags"].append(container_tag)
+    images["container_ids"].append(container_id)
+    images["bounds"].append(bounds)
+    images["transforms"].append(transform)
+    return True
+
+
+def add_page_text(page_data, story_id, frame_id, content, bounds, transform):
+    """Appends a text frame to page_data unless its frame id is already there."""
+    if frame_id in page_data["text_frame_ids"]:
+        return False
+    page_data["text_frame_ids"].add(frame_id)
+    texts = page_data["texts"]
+    texts["story_ids"].append(story_id)
+    texts["frame_ids"].append(frame_id)
+    texts["contents"].append(content)
+    texts["bounds"].append(bounds)
+    texts["transforms"].append(transform)
+    return True
+
+
+def process_spread_item(
+    element,
+    parent_element,
+    element_tag_local,
+    item_global_aabb,
+    item_center,
+    assigned_page_id,
+    pages_content_map,
+    idml_path,
+    missing_stories,
+    depth=0,
+):
+    indent = "  " * (depth + 2)
+    element_id = element.get("Self", "UnknownID")
+    item_local_matrix_str = element.get("ItemTransform")
+    item_center_x, item_center_y = item_center
 
     # --- Handle Image (often inside Rectangle, Oval, Polygon) ---
     if element_tag_local == "Image":
         if assigned_page_id:
-            link_element = element.find(".//{*}Link")
-            if link_element is not None:
+            link_matches = XP_LINK(element)
+            if link_matches:
+                link_element = link_matches[0]
                 uri = link_element.get("LinkResourceURI")
                 if uri:
                     page_data = pages_content_map.get(assigned_page_id)
@@ -259,122 +476,126 @@ def process_spread_element_recursively(
                         if (
                             parent_element is not None
                         ):  # Check if parent_element was passed
-                            container_tag = parent_element.tag.split("}")[-1]
+                            container_tag = local_tag_name(parent_element.tag)
                             container_id = parent_element.get("Self", "Unknown")
 
-                        if not any(
-                            img["uri"] == uri and img["image_element_id"] == element_id
-                            for img in page_data["images"]
+                        if add_page_image(
+                            page_data,
+                            uri,
+                            element_id,
+                            container_tag,  # Use parent_element info
+                            container_id,  # Use parent_element info
+                            item_global_aabb,
+                            item_local_matrix_str,
                         ):
-                            page_data["images"].append(
-                                {
-                                    "uri": uri,
-                                    "image_element_id": element_id,
-                                    "container_element_tag": container_tag,  # Use parent_element info
-                                    "container_element_id": container_id,  # Use parent_element info
-                                    "global_bounds": item_global_aabb,
-                                    "item_transform": item_local_matrix_str,
-                                }
-                            )
-                            print(
-                                f"{indent}🖼️ Added Image Link: '{uri}' (ID: {element_id}) to Page ID: {assigned_page_id}. Container: <{container_tag} ID:{container_id}> Bounds: x1={item_global_aabb['x1']:.1f}, y1={item_global_aabb['y1']:.1f}"
+                            logger.debug(
+                                "%s🖼️ Added Image Link: '%s' (ID: %s) to Page ID: %s. Container: <%s ID:%s> Bounds: x1=%.1f, y1=%.1f",
+                                indent,
+                                uri,
+                                element_id,
+                                assigned_page_id,
+                                container_tag,
+                                container_id,
+                                item_global_aabb[0],
+                                item_global_aabb[1],
                             )
 
     elif element_tag_local == "TextFrame":
         story_id = element.get("ParentStory")
+        if story_id:
+            # Ids are dict keys throughout; interning keeps one string per id
+            story_id = sys.intern(story_id)
         # --- Start Crucial Debug Prints for TextFrames ---
-        print(
-            f"{indent}Processing TextFrame ID: {element_id}, StoryID: {story_id}, CalculatedCenter: ({item_center_x:.1f},{item_center_y:.1f}), AssignedPageID: {assigned_page_id}"
+        logger.debug(
+            "%sProcessing TextFrame ID: %s, StoryID: %s, CalculatedCenter: (%.1f,%.1f), AssignedPageID: %s",
+            indent,
+            element_id,
+            story_id,
+            item_center_x,
+            item_center_y,
+            assigned_page_id,
         )
         # --- End Crucial Debug Prints ---
         if assigned_page_id and story_id:
-            if story_id not in story_cache:
-                story_filename = f"Story_{story_id}.xml"
-                story_file_path = os.path.join(stories_dir, story_filename)
-                # print(f"{indent}  Attempting to load story: {story_filename}") # Keep this less verbose unless needed
-                if os.path.exists(story_file_path):
-                    story_cache[story_id] = get_story_text(
-                        story_file_path
-                    )  # Ensure get_story_text logs its own errors
-                else:
-                    print(
-                        f"{indent}  ❌ Story file {story_filename} NOT FOUND for TextFrame ID: {element_id}"
-                    )
-                    story_cache[story_id] = ""
+            story_file_path = idml_story_paths(idml_path).get(story_id)
+            # print(f"{indent}  Attempting to load story: {story_file_path}") # Keep this less verbose unless needed
+            if story_file_path is not None:
+                text_content = get_story_text(
+                    idml_path, story_file_path
+                )  # Memoized; ensure get_story_text logs its own errors
+            else:
+                # Reported once per story by main, however many frames use it
+                missing_stories.setdefault(story_id, element_id)
+                text_content = ""
 
-            text_content = story_cache.get(story_id, "")
             page_data = pages_content_map.get(assigned_page_id)
 
             # --- Start Crucial Debug Prints for TextFrames ---
-            print(
-                f"{indent}  For TextFrame {element_id} on Page {assigned_page_id}: Page data OK: {page_data is not None}. Text content len: {len(text_content)}. Story: {story_id}"
+            logger.debug(
+                "%s  For TextFrame %s on Page %s: Page data OK: %s. Text content len: %d. Story: %s",
+                indent,
+                element_id,
+                assigned_page_id,
+                page_data is not None,
+                len(text_content),
+                story_id,
             )
             # --- End Crucial Debug Prints ---
 
             if page_data:
-                is_tf_added = any(
-                    tf["text_frame_id"] == element_id for tf in page_data["texts"]
-                )
-                if not is_tf_added:
-                    if text_content:  # Only add if there's actual content
-                        page_data["texts"].append(
-                            {
-                                "story_id": story_id,
-                                "text_frame_id": element_id,
-                                "content": text_content,
-                                "global_bounds": item_global_aabb,
-                                "item_transform": item_local_matrix_str,
-                            }
-                        )
-                        print(
-                            f"{indent}  ✅ Added TextFrame ID: {element_id} (Story: {story_id}) to Page ID: {assigned_page_id}."
-                        )
-                    elif (
-                        story_id in story_cache
-                    ):  # text_content is empty but story_id was processed
-                        print(
-                            f"{indent}  ℹ️ TextFrame ID: {element_id} (Story: {story_id}) has empty text_content from cache (story empty or parse error), not adding."
+                if text_content:  # Only add if there's actual content
+                    if add_page_text(
+                        page_data,
+                        story_id,
+                        element_id,
+                        text_content,
+                        item_global_aabb,
+                        item_local_matrix_str,
+                    ):
+                        logger.debug(
+                            "%s  ✅ Added TextFrame ID: %s (Story: %s) to Page ID: %s.",
+                            indent,
+                            element_id,
+                            story_id,
+                            assigned_page_id,
                         )
+                else:  # text_content is empty but story_id was processed
+                    logger.debug(
+                        "%s  ℹ️ TextFrame ID: %s (Story: %s) has empty text_content from cache (story empty or parse error), not adding.",
+                        indent,
+                        element_id,
+                        story_id,
+                    )
         elif story_id:
-            print(
-                f"{indent}⚠️ TextFrame ID: {element_id} (Story: {story_id}) at center ({item_center_x:.1f},{item_center_y:.1f}) was NOT assigned to any page."
+            logger.debug(
+                "%s⚠️ TextFrame ID: %s (Story: %s) at center (%.1f,%.1f) was NOT assigned to any page.",
+                indent,
+                element_id,
+                story_id,
+                item_center_x,
+                item_center_y,
             )
         pass
-    # --- Recursively process children ---
-    if element_tag_local in ["Group", "Rectangle", "Oval", "Polygon"]:
-        for child_element in element:
-            process_spread_element_recursively(
-                child_element,
-                element,  # Pass current element as the parent for the child
-                item_global_matrix,
-                geometric_pages,
-                pages_content_map,
-                stories_dir,
-                story_cache,
-                depth + 1,
-            )
 
 
-def get_page_content_from_spread(spread_path, stories_dir, story_cache):
+def get_page_content_from_spread(idml_path, spread_path, missing_stories):
     try:
-        tree = ET.parse(spread_path)
+        with open_idml(idml_path).open(spread_path) as spread_file:
+            tree = ET.parse(spread_file, SPREAD_PARSER)
         root = tree.getroot()
 
         spread_element = root
-        if root.tag.endswith("Spread") and not any(
-            child.tag.split("}")[-1] == "Page" for child in root
-        ):
-            actual_spread_candidate = root.find("{*}Spread")
-            if actual_spread_candidate is not None:
-                spread_element = actual_spread_candidate
-            else:
-                if not any(child.tag.split("}")[-1] == "Page" for child in root):
-                    print(
-                        f"  ❌ Error: Could not find the main <Spread> element with <Page> children in {os.path.basename(spread_path)}"
-                    )
-                    return {}
+        if root.tag.endswith("Spread") and root.find("Page") is None:
+            # A root without pages is the idPkg:Spread wrapper; the content
+            # <Spread> is its direct child, so no wider search is needed
+            spread_element = root.find("Spread")
+            if spread_element is None:
+                print(
+                    f"  ❌ Error: Could not find the main <Spread> element with <Page> children in {os.path.basename(spread_path)}"
+                )
+                return {}
         print(
-            f"  Processing Spread Element: <{spread_element.tag.split('}')[-1]} Self='{spread_element.get('Self')}'>"
+            f"  Processing Spread Element: <{local_tag_name(spread_element.tag)} Self='{spread_element.get('Self')}'>"
         )
     except Exception as e:
         print(f"  ❌ Error parsing or finding spread element in {spread_path}: {e}")
@@ -383,23 +604,20 @@ def get_page_content_from_spread(spread_path, stories_dir, story_cache):
     current_spread_pages_content = {}
     geometric_pages = []
 
-    for page_el in spread_element.findall(".//{*}Page"):
+    for page_el in XP_PAGE(spread_element):
         pid = page_el.get("Self")
         name = page_el.get("Name", f"UnnamedPage_{pid}")
         if not pid:
             print(f"  ⚠️ Found a Page element without a 'Self' ID. Skipping.")
             continue
+        pid = sys.intern(pid)
 
         page_info = PageGeometricInfo(
             pid, name, page_el.get("ItemTransform"), page_el.get("GeometricBounds")
         )
         geometric_pages.append(page_info)
         if pid not in current_spread_pages_content:
-            current_spread_pages_content[pid] = {
-                "name": name,
-                "images": [],
-                "texts": [],
-            }
+            current_spread_pages_content[pid] = new_page_content(name)
     if not geometric_pages:
         print(
             f"  ℹ️ No Page elements with geometric info found. Cannot associate content."
@@ -409,190 +627,250 @@ def get_page_content_from_spread(spread_path, stories_dir, story_cache):
     spread_base_matrix_str = spread_element.get("ItemTransform")
     spread_base_matrix = parse_transform_matrix(spread_base_matrix_str)
     # print(f'>> spread element length == {len(spread_element)}')
-    for child_el in spread_element:
-        child_tag_local = child_el.tag.split("}")[-1]
-        # print(f'>> -- child_el --- {child_tag_local}')
-        if child_tag_local in [
-            "Page",
-            "FlattenerPreference",
-            "Properties",
-        ]:  # Skip already processed or non-content metadata
-            continue
-        process_spread_element_recursively(
-            child_el,
-            spread_element,
-            spread_base_matrix,
-            geometric_pages,
+    items = flatten_spread_items(spread_element)
+    if not items:
+        return current_spread_pages_content
+    item_global_aabbs, item_centers = compute_items_geometry(items, spread_base_matrix)
+    assigned_page_ids = assign_items_to_pages(item_centers, geometric_pages)
+    item_global_aabbs = item_global_aabbs.tolist()
+    item_centers = item_centers.tolist()
+    for i, (element, parent_element, element_tag_local, _, depth) in enumerate(items):
+        process_spread_item(
+            element,
+            parent_element,
+            element_tag_local,
+            item_global_aabbs[i],
+            item_centers[i],
+            assigned_page_ids[i],
             current_spread_pages_content,
-            stories_dir,
-            story_cache,
+            idml_path,
+            missing_stories,
+            depth,
         )
     # print(f'<<<<<<<<<<<< spread pages content:\n{current_spread_pages_content}')
     return current_spread_pages_content
 
 
 # --- Main function and argument parsing (similar to before) ---
-def find_spread_files(spreads_dir):
-    if not os.path.isdir(spreads_dir):
-        print(f"❌ Spreads directory not found at: {spreads_dir}")
-        return []
+def find_spread_files(member_names):
     files = [
-        os.path.join(spreads_dir, f)
-        for f in os.listdir(spreads_dir)
-        if f.startswith("Spread_") and f.endswith(".xml")
+        name
+        for name in member_names
+        if name.startswith(SPREADS_PREFIX + "Spread_") and name.endswith(".xml")
     ]
     if not files:
-        print(f"ℹ️ No spread XML files (Spread_*.xml) found in {spreads_dir}")
-    # else: print(f"Found spread files in {spreads_dir}: {files}") # Verbose
+        print(f"ℹ️ No spread XML files ({SPREADS_PREFIX}Spread_*.xml) found in package")
+    # else: print(f"Found spread files: {files}") # Verbose
     return files
 
 
-def find_story_files(stories_dir):
-    if not os.path.isdir(stories_dir):
-        # print(f"❌ Stories directory not found at: {stories_dir}") # Can be optional if no text
-        return []
+def find_story_files(member_names):
     files = [
-        f
-        for f in os.listdir(stories_dir)
-        if f.startswith("Story_") and f.endswith(".xml")
+        os.path.basename(name)
+        for name in member_names
+        if name.startswith(STORIES_PREFIX + "Story_") and name.endswith(".xml")
     ]
-    # if not files: print(f"ℹ️ No story XML files (Story_*.xml) found in {stories_dir}") # Verbose
-    # else: print(f"Found story files in {stories_dir}: {files[:5]}..." if len(files) > 5 else files) # Verbose
+    # if not files: print(f"ℹ️ No story XML files (Story_*.xml) found in package") # Verbose
+    # else: print(f"Found story files: {files[:5]}..." if len(files) > 5 else files) # Verbose
     return files
 
 
+def process_spread_file(spread_file_path, idml_path, log_level):
+    """Walks one spread for main; returns its page content, the stories it references
+    that the package lacks ({story_id: first frame id}) and the log it produced."""
+    spread_log = io.StringIO()
+    missing_stories = {}
+    # Log records and prints go to the same buffer, so they keep their relative order
+    handler = logging.StreamHandler(spread_log)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(log_level)
+    logger.propagate = False
+    try:
+        with contextlib.redirect_stdout(spread_log):
+            content_from_this_spread = get_page_content_from_spread(
+                idml_path, spread_file_path, missing_stories
+            )
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(logging.NOTSET)
+        logger.propagate = True
+    return content_from_this_spread, missing_stories, spread_log.getvalue()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Extract content per page from IDML, including text frame bounding boxes."
     )
     parser.add_argument("idml_file", help="Path to .idml file")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Log per-item processing details"
+    )
     args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(message)s",
+        stream=sys.stdout,
+    )
 
-    temp_dir_base = os.path.join(tempfile.gettempdir(), "idml_extractor_debug")
-    os.makedirs(temp_dir_base, exist_ok=True)
-    temp_dir = tempfile.mkdtemp(prefix="idml_", dir=temp_dir_base)
-
-    print(f"⏳ Extracting '{args.idml_file}' to: {temp_dir}")
-    if not extract_idml(args.idml_file, temp_dir):
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+    # main only needs the member names; the spreads and the stories they use are
+    # inflated later, by whichever process walks the spread.
+    print(f"⏳ Reading '{args.idml_file}'")
+    try:
+        with zipfile.ZipFile(args.idml_file, "r") as zip_ref:
+            member_names = zip_ref.namelist()
+    except Exception as e:
+        print(f"❌ Could not open IDML: {e}")
         return
 
-    # print(f"📂 Contents of temp_dir '{temp_dir}': {os.listdir(temp_dir)}") # Verbose
+    # print(f"📂 Package members: {member_names}") # Verbose
 
-    spreads_dir = os.path.join(temp_dir, "Spreads")
-    stories_dir = os.path.join(temp_dir, "Stories")
-
-    if not os.path.isdir(spreads_dir):
-        print(f"❌ Critical: 'Spreads' folder missing at '{spreads_dir}'.")
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+    if not any(name.startswith(SPREADS_PREFIX) for name in member_names):
+        print(f"❌ Critical: '{SPREADS_PREFIX}' folder missing from package.")
         return
-    # find_story_files(stories_dir) # Optional: for debugging available stories
+    # find_story_files(member_names) # Optional: for debugging available stories
 
     all_page_data_by_id = {}
-    story_cache = {}
+    reported_missing_stories = set()
 
-    spread_files = find_spread_files(spreads_dir)
+    spread_files = find_spread_files(member_names)
     if not spread_files:
         print("❌ No spread files found.")
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
         return
 
-    for spread_file_path in spread_files:
-        spread_name = os.path.basename(spread_file_path)
-        print(f"\n📄 Processing Spread File: {spread_name}")
-
-        content_from_this_spread = get_page_content_from_spread(
-            spread_file_path, stories_dir, story_cache
-        )
+    # No spread's geometry depends on another's, so a process pool walks them while
+    # this loop prints each result (with its log) in file order. With a single
+    # spread there is nothing to overlap, and it is walked in-process.
+    worker = functools.partial(
+        process_spread_file,
+        idml_path=args.idml_file,
+        log_level=logging.getLogger().getEffectiveLevel(),
+    )
+    with contextlib.ExitStack() as stack:
+        if len(spread_files) < 2:
+            spread_results = map(worker, spread_files)
+        else:
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor())
+            spread_results = executor.map(worker, spread_files)
+        for spread_file_path, (
+            content_from_this_spread,
+            missing_stories,
+            spread_log,
+        ) in zip(spread_files, spread_results):
+            spread_name = os.path.basename(spread_file_path)
+            print(f"\n📄 Processing Spread File: {spread_name}")
+            sys.stdout.write(spread_log)
+            for story_id, element_id in missing_stories.items():
+                if story_id not in reported_missing_stories:
+                    reported_missing_stories.add(story_id)
+                    logger.warning(
+                        "  ❌ Story file Story_%s.xml NOT FOUND (first referenced by TextFrame ID: %s)",
+                        story_id,
+                        element_id,
+                    )
 
-        for pid, pdata_in_spread in content_from_this_spread.items():
-            if pid not in all_page_data_by_id:
-                all_page_data_by_id[pid] = {
-                    "name": pdata_in_spread["name"],
-                    "images": list(pdata_in_spread["images"]),
-                    "texts": list(pdata_in_spread["texts"]),
-                }
-            else:
-                print(
-                    f"  🔄 Aggregating content for Page ID {pid} (Name: {pdata_in_spread['name']})"
-                )
-                for img_item in pdata_in_spread["images"]:  # Images are now dicts
+            for pid, pdata_in_spread in content_from_this_spread.items():
+                pid = sys.intern(pid)  # Ids come back from the workers as fresh strings
+                if pid not in all_page_data_by_id:
+                    # Nothing else refers to this spread's page record, so it is kept directly
+                    all_page_data_by_id[pid] = pdata_in_spread
+                else:
+                    print(
+                        f"  🔄 Aggregating content for Page ID {pid} (Name: {pdata_in_spread['name']})"
+                    )
+                    page_entry = all_page_data_by_id[pid]
+                    images = pdata_in_spread["images"]
                     # Crude check for duplication based on URI and image element ID
-                    if not any(
-                        existing_img["uri"] == img_item["uri"]
-                        and existing_img["image_element_id"]
-                        == img_item["image_element_id"]
-                        for existing_img in all_page_data_by_id[pid]["images"]
+                    for row in zip(
+                        images["uris"],
+                        images["elem_ids"],
+                        images["container_tags"],
+                        images["container_ids"],
+                        images["bounds"],
+                        images["transforms"],
                     ):
-                        all_page_data_by_id[pid]["images"].append(img_item)
-
-                current_tf_ids = {
-                    t["text_frame_id"] for t in all_page_data_by_id[pid]["texts"]
-                }
-                for text_item in pdata_in_spread["texts"]:  # Texts are now dicts
-                    if text_item["text_frame_id"] not in current_tf_ids:
-                        all_page_data_by_id[pid]["texts"].append(text_item)
-                        current_tf_ids.add(text_item["text_frame_id"])
+                        add_page_image(page_entry, *row)
+
+                    texts = pdata_in_spread["texts"]
+                    for row in zip(
+                        texts["story_ids"],
+                        texts["frame_ids"],
+                        texts["contents"],
+                        texts["bounds"],
+                        texts["transforms"],
+                    ):
+                        add_page_text(page_entry, *row)
 
-    print("\n\n--- ✨ Consolidated Content Per Page ✨ ---")
+    # The report is built in memory and written to stdout in one go.
+    report = io.StringIO()
+    report.write("\n\n--- ✨ Consolidated Content Per Page ✨ ---\n")
     if not all_page_data_by_id:
-        print("No content found on any pages after processing all spreads.")
+        report.write("No content found on any pages after processing all spreads.\n")
     else:
-        final_sorted_page_ids = sorted(
-            all_page_data_by_id.keys(),
-            key=lambda pid_key: all_page_data_by_id[pid_key]["name"],
-        )
+        final_sorted_page_ids = [
+            pid
+            for _, pid in sorted(
+                (pdata["name"], pid) for pid, pdata in all_page_data_by_id.items()
+            )
+        ]
 
         for pid in final_sorted_page_ids:
             pdata = all_page_data_by_id[pid]
-            print(f"\n--- Page \"{pdata['name']}\" (ID: {pid}) ---")
-            if pdata["texts"]:
-                print("📝 Texts:")
-                for t_idx, t_item in enumerate(pdata["texts"]):
+            report.write(f"\n--- Page \"{pdata['name']}\" (ID: {pid}) ---\n")
+            texts = pdata["texts"]
+            if texts["frame_ids"]:
+                report.write("📝 Texts:\n")
+                text_bounds = np.array(texts["bounds"], dtype=GEOMETRY_DTYPE)
+                for t_idx, (story_id, frame_id, content, bounds) in enumerate(
+                    zip(
+                        texts["story_ids"],
+                        texts["frame_ids"],
+                        texts["contents"],
+                        text_bounds,
+                    )
+                ):
                     content_prev = (
-                        (t_item["content"][:70] + "...")
-                        if len(t_item["content"]) > 70
-                        else t_item["content"]
+                        (content[:70] + "...") if len(content) > 70 else content
                     )
                     content_prev = content_prev.replace("\n", "\\n")
-                    bounds = t_item["global_bounds"]
-                    print(
-                        f"  [{t_idx+1}] Story ID: {t_item['story_id']} (Frame: {t_item['text_frame_id']})"
+                    x1, y1, x2, y2 = map(float, bounds)
+                    report.write(
+                        f"  [{t_idx+1}] Story ID: {story_id} (Frame: {frame_id})\n"
                     )
-                    print(f'      Content: "{content_prev}"')
-                    print(
-                        f"      GlobalBounds: x1={bounds['x1']:.2f}, y1={bounds['y1']:.2f}, x2={bounds['x2']:.2f}, y2={bounds['y2']:.2f}"
+                    report.write(f'      Content: "{content_prev}"\n')
+                    report.write(
+                        f"      GlobalBounds: x1={x1:.2f}, y1={y1:.2f}, x2={x2:.2f}, y2={y2:.2f}\n"
                     )
-                    # print(f"      ItemTransform: {t_item['item_transform']}") # Optional: for debugging
+                    # print(f"      ItemTransform: {texts['transforms'][t_idx]}") # Optional: for debugging
             else:
-                print("📝 Texts: None")
-
-            if pdata["images"]:
-                print("🖼 Images:")
-                for img_item in pdata["images"]:
-                    bounds = img_item["global_bounds"]
-                    print(f"  - URI: {img_item['uri']}")
-                    print(
-                        f"    ImageElemID: {img_item['image_element_id']}, Container: <{img_item['container_element_tag']} ID:{img_item['container_element_id']}>"
+                report.write("📝 Texts: None\n")
+
+            images = pdata["images"]
+            if images["uris"]:
+                report.write("🖼 Images:\n")
+                image_bounds = np.array(images["bounds"], dtype=GEOMETRY_DTYPE)
+                for uri, elem_id, container_tag, container_id, bounds, transform in zip(
+                    images["uris"],
+                    images["elem_ids"],
+                    images["container_tags"],
+                    images["container_ids"],
+                    image_bounds,
+                    images["transforms"],
+                ):
+                    x1, y1, x2, y2 = map(float, bounds)
+                    report.write(f"  - URI: {uri}\n")
+                    report.write(
+                        f"    ImageElemID: {elem_id}, Container: <{container_tag} ID:{container_id}>\n"
                     )
-                    print(
-                        f"    GlobalBounds: x1={bounds['x1']:.2f}, y1={bounds['y1']:.2f}, x2={bounds['x2']:.2f}, y2={bounds['y2']:.2f}"
+                    report.write(
+                        f"    GlobalBounds: x1={x1:.2f}, y1={y1:.2f}, x2={x2:.2f}, y2={y2:.2f}\n"
                     )
-                    # print(f"    ItemTransform: {img_item['item_transform']}") # Optional: for debugging
+                    # print(f"    ItemTransform: {transform}") # Optional: for debugging
             else:
-                print("🖼 Images: None")
+                report.write("🖼 Images: None\n")
+    sys.stdout.write(report.getvalue())
 
-    print("\n✅ Done. Cleaning up temporary directory...")
-    try:
-        shutil.rmtree(temp_dir)
-        print(f"🗑️ Temporary directory {temp_dir} removed.")
-    except Exception as e:  # Use 'as e'
-        print(
-            f"⚠️ Error removing temporary directory {temp_dir}: {e}. Please remove manually."
-        )
+    print("\n✅ Done.")
 
 
 if __name__ == "__main__":
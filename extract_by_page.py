@@ -1,51 +1,78 @@
 import zipfile
-import xml.etree.ElementTree as ET
-import os
+from lxml import etree as ET
 import argparse
-import shutil
-import tempfile
-import re
+import functools
+import concurrent.futures
+import contextlib
+import io
+import sys
 
-def extract_idml(idml_path, extract_to):
-    """Extracts the contents of an IDML file (which is a zip archive)."""
-    try:
-        with zipfile.ZipFile(idml_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_to)
-        return True
-    except Exception as e:
-        print(f"Extraction failed: {e}")
-        return False
+# IDML's namespace is fixed: only the idPkg:* wrapper elements are namespaced, while story and
+# spread content (Content, Page, TextFrame, ...) is in no namespace. Plain tag names therefore
+# match exactly, with no '{*}' wildcard or local-name() tests.
+STORY_TAGS = ('Content', 'Br') # Tags streamed by iterparse
+FRAME_TAGS = frozenset({'Rectangle', 'Oval', 'Polygon', 'Group'}) # Add other containers if necessary
+SPREAD_TAGS = ('Page', 'TextFrame', 'Image', *FRAME_TAGS)
+
+class PageContent:
+    """Images and texts found on one page; the sets mirror the ordered lists for dedup."""
+    __slots__ = ("name", "images", "texts", "image_uris", "story_ids")
+
+    def __init__(self, name):
+        self.name = name
+        self.images = []
+        self.texts = []
+        self.image_uris = set()
+        self.story_ids = set()
+
+class StoryText:
+    """A story's text as placed on a page."""
+    __slots__ = ("story_id", "content")
+
+    def __init__(self, story_id, content):
+        self.story_id = story_id
+        self.content = content
+
+def release_element(element):
+    """Clears a streamed story or spread element and unlinks the siblings before it, so neither file is kept whole."""
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+SPREADS_PREFIX = "Spreads/"
+STORIES_PREFIX = "Stories/"
+
+@functools.lru_cache(maxsize=None)
+def open_idml(idml_path):
+    """This process's handle on the package; load_story and the spread walk open members through it."""
+    return zipfile.ZipFile(idml_path, 'r')
 
-def get_story_text(story_path):
-    """Parses a Story XML file and extracts all text content."""
-    text_content = []
+def get_story_text(story_file, story_path):
+    """Parses an open Story XML member (story_path names it in messages) and extracts all text content."""
+    tagged_content = io.StringIO() # Content/Br directly under an XMLElement, preferred when present
+    text_content = io.StringIO() # Every Content/Br of the story, in document order
+    write_tagged = tagged_content.write
+    write_text = text_content.write
     try:
-        tree = ET.parse(story_path)
-        root = tree.getroot()
-        # Iterate through elements in document order to try and preserve paragraph/break sequence
-        for element in root.findall('.//{*}XMLElement/*'): # A common parent for story content
-            if element.tag.endswith('Content'):
-                if element.text:
-                    text_content.append(element.text) # .strip() could remove leading/trailing spaces of segments
-            elif element.tag.endswith('Br'):
-                text_content.append('\n')
-        
-        # Fallback or additional method for broader content grabbing if above is too restrictive
-        if not text_content:
-            for content_element in root.findall('.//{*}Content'):
-                if content_element.text:
-                    text_content.append(content_element.text)
-            # This Br handling might add too many newlines if also caught by XMLElement iteration
-            # Consider if Br should only be handled once or if Story structure guarantees no overlap.
-            # For now, let's assume it's okay and will be cleaned up.
-            for br_element in root.findall('.//{*}Br'): # Br might not be under XMLElement
-                 text_content.append('\n')
-
-        full_text = "".join(text_content) # Don't filter None, join handles it. Avoid stripping individual segments.
+        # Single streaming pass; elements are released as soon as they are read
+        story_elements = ET.iterparse(story_file, events=("end",), tag=STORY_TAGS)
+        for _, element in story_elements:
+            if element.tag == 'Content':
+                piece = element.text # .strip() could remove leading/trailing spaces of segments
+            else:
+                piece = '\n'
+            if piece:
+                write_text(piece)
+                parent = element.getparent()
+                if parent is not None and parent.tag == 'XMLElement':
+                    write_tagged(piece)
+            release_element(element)
+
+        full_text = tagged_content.getvalue() or text_content.getvalue()
         
         # Consolidate multiple newlines and strip leading/trailing whitespace from the whole story
-        full_text = re.sub(r'\s*\n\s*', '\n', full_text) # Normalize newlines and surrounding spaces
-        full_text = re.sub(r'\n+', '\n', full_text).strip() # Consolidate multiple newlines
+        # (stripping every line and dropping blank ones; no leading/trailing whitespace survives the join)
+        full_text = "\n".join(line.strip() for line in full_text.split("\n") if line and not line.isspace())
         return full_text
     except ET.ParseError as e:
         print(f"Error parsing story XML {story_path}: {e}")
@@ -54,162 +81,192 @@ def get_story_text(story_path):
         print(f"Unexpected error getting story text from {story_path}: {e}")
         return ""
 
+@functools.lru_cache(maxsize=None)
+def load_story(idml_path, story_id):
+    """Memoized text of a story by its Self ID; "" if the package has no such Story member."""
+    story_file_path = f"{STORIES_PREFIX}Story_{story_id}.xml" # Assuming this naming convention
+    try: # Open directly rather than checking for the member first
+        story_file = open_idml(idml_path).open(story_file_path)
+    except KeyError:
+        # print(f"Warning: Story file {story_file_path} not found for story ID {story_id}")
+        return ""
+    with story_file:
+        return get_story_text(story_file, story_file_path)
+
 
-def get_page_content_from_spread(spread_path, stories_dir, story_cache):
-    """Parses a spread XML and extracts image/text grouped by Page ID."""
+def get_page_content_from_spread(idml_path, spread_path):
+    """Parses a spread XML member and extracts image/text grouped by Page ID."""
+    idml = open_idml(idml_path)
+    pages_content = {} # Key: Page Self ID (interned), Value: PageContent
+    text_frames = [] # (ParentPage, ParentStory) per TextFrame, in document order
+    frame_images = [] # (ParentPage of each enclosing frame, image URI), in document order
+    open_frame_pages = [] # ParentPage of every graphic frame enclosing the current element
+
+    # One streaming pass visits every element once and collects pages, text frames and images;
+    # pages may appear after the items that reference them, so page membership is resolved
+    # once the pass is done.
     try:
-        tree = ET.parse(spread_path)
-        root = tree.getroot()
+        with idml.open(spread_path) as spread_file:
+            spread_elements = ET.iterparse(spread_file, events=("start", "end"), tag=SPREAD_TAGS)
+            for event, element in spread_elements:
+                tag = element.tag
+                if tag in FRAME_TAGS:
+                    if event == "start":
+                        page_id = element.get("ParentPage")
+                        open_frame_pages.append(sys.intern(page_id) if page_id else page_id)
+                        continue
+                    open_frame_pages.pop()
+                elif event == "start":
+                    continue
+                elif tag == 'Page':
+                    pid = element.get("Self")
+                    if pid:
+                        name = element.get("Name", f"UnnamedPage_{pid}")
+                        pages_content[sys.intern(pid)] = PageContent(name)
+                elif tag == 'TextFrame':
+                    # ParentPage is an attribute on TextFrame pointing to the Page's Self ID;
+                    # frames without a page (e.g. on the pasteboard) or without a story are skipped here
+                    page_id = element.get("ParentPage")
+                    story_id = element.get("ParentStory") # Points to Story Self ID (e.g., "u123")
+                    # print(f'page_id = {page_id}   story_id = {story_id}') # Verbose
+                    if page_id and story_id:
+                        # Interned page ids make the page lookups pointer compares
+                        text_frames.append((sys.intern(page_id), story_id))
+                else: # Image: images sit inside graphic frames like Rectangle, Oval, Polygon, which have ParentPage
+                    link = element.find('Link') # Link is always a direct child of Image
+                    uri = link.get("LinkResourceURI") if link is not None else None
+                    if uri:
+                        frame_images.append((list(open_frame_pages), uri))
+                release_element(element)
     except ET.ParseError as e:
         print(f"Error parsing spread XML {spread_path}: {e}")
         return {}
 
-    pages_content = {} # Key: Page Self ID, Value: {name, images, texts}
-
-    # Map page ID to page Name and initialize content lists
-    for page_element in root.findall('.//{*}Page'):
-        pid = page_element.attrib.get("Self")
-        if not pid:
-            continue
-        name = page_element.attrib.get("Name", f"UnnamedPage_{pid}")
-        pages_content[pid] = {"name": name, "images": [], "texts": []}
-    
     # Process TextFrames
-    for tf in root.findall('.//{*}TextFrame'):
-        # ParentPage is an attribute on TextFrame pointing to the Page's Self ID
-        page_id = tf.attrib.get("ParentPage")
-        story_id = tf.attrib.get("ParentStory") # Points to Story Self ID (e.g., "u123")
-        print(f'page_id = {page_id}   story_id = {story_id}')
-        
-        if page_id in pages_content and story_id:
-            if story_id not in story_cache:
-                story_filename = f"Story_{story_id}.xml" # Assuming this naming convention
-                story_file_path = os.path.join(stories_dir, story_filename)
-                if os.path.exists(story_file_path):
-                    story_cache[story_id] = get_story_text(story_file_path)
-                else:
-                    # print(f"Warning: Story file {story_filename} not found for story ID {story_id}")
-                    story_cache[story_id] = "" # Cache empty if not found
-            
-            # Avoid adding the same story multiple times if multiple text frames on the page use it
-            # Check if this story content is already added for this page_id
-            is_story_already_added = any(
-                t['story_id'] == story_id for t in pages_content[page_id]["texts"]
-            )
-            if not is_story_already_added and story_cache[story_id]: # Add if not present and has content
-                pages_content[page_id]["texts"].append({
-                    "story_id": story_id,
-                    "content": story_cache[story_id]
-                })
-
-    # Process Images - Images are inside graphic frames like Rectangle, Oval, Polygon
-    # These frames have ParentPage.
-    for frame_type_name in ['Rectangle', 'Oval', 'Polygon', 'Group']: # Add other containers if necessary
-        for frame in root.findall(f'.//{{*}}{frame_type_name}'):
-            page_id = frame.attrib.get("ParentPage")
-            if page_id in pages_content:
-                # Find Image elements within this frame (can be nested)
-                for img in frame.findall('.//{*}Image'):
-                    link = img.find('.//{*}Link')
-                    if link is not None: # Check if link element exists
-                        uri = link.attrib.get("LinkResourceURI")
-                        if uri:
-                            # Avoid duplicate URIs for the same page
-                            if uri not in pages_content[page_id]["images"]:
-                                pages_content[page_id]["images"].append(uri)
+    for page_id, story_id in text_frames:
+        page = pages_content.get(page_id)
+        # Avoid adding the same story multiple times if multiple text frames on the page use it
+        if page is None or story_id in page.story_ids:
+            continue
+        story_text = load_story(idml_path, story_id)
+        if story_text: # Add only if it has content
+            page.story_ids.add(story_id)
+            page.texts.append(StoryText(story_id, story_text))
+
+    # Process Images - an image belongs to the page of every enclosing frame
+    for page_ids, uri in frame_images:
+        for page_id in page_ids:
+            page = pages_content.get(page_id)
+            # Avoid duplicate URIs for the same page
+            if page is not None and uri not in page.image_uris:
+                page.image_uris.add(uri)
+                page.images.append(uri)
     return pages_content
 
-def find_spread_files(spreads_dir):
-    """Finds all spread XML files in the Spreads directory."""
-    return [os.path.join(spreads_dir, f) for f in os.listdir(spreads_dir) if f.startswith("Spread_") and f.endswith(".xml")]
+def find_spread_files(member_names):
+    """Finds all spread XML members in the package's Spreads folder."""
+    return [n for n in member_names if n.startswith(SPREADS_PREFIX + "Spread_") and n.endswith(".xml")]
+
+def process_spread_file(spread_file, idml_path):
+    """Walks one spread with stdout captured, so main can print the log under the spread's header."""
+    spread_log = io.StringIO()
+    with contextlib.redirect_stdout(spread_log):
+        content_from_spread = get_page_content_from_spread(idml_path, spread_file)
+    return content_from_spread, spread_log.getvalue()
+
+def aggregate_spread_content(all_page_data_by_id, content_from_spread):
+    """Merges one spread's pages into all_page_data_by_id, keyed by unique Page Self ID."""
+    for pid, pdata_in_spread in content_from_spread.items():
+        pid = sys.intern(pid) # Unpickled worker results are no longer interned
+        page = all_page_data_by_id.get(pid)
+        if page is None:
+            # First time this page ID is seen; the worker's result is a private copy, adopt it
+            all_page_data_by_id[pid] = pdata_in_spread
+            continue
+
+        # Aggregate images, ensuring no duplicates
+        for img_uri in pdata_in_spread.images:
+            if img_uri not in page.image_uris:
+                page.image_uris.add(img_uri)
+                page.images.append(img_uri)
+
+        # Aggregate texts, ensuring no duplicate story objects for the same page
+        for text_item in pdata_in_spread.texts:
+            if text_item.story_id not in page.story_ids:
+                page.story_ids.add(text_item.story_id)
+                page.texts.append(text_item)
+
+def page_name_key(name):
+    """Sort key for page names: numeric names by value, then any other names alphabetically."""
+    return (int(name), "") if name.isdecimal() else (float("inf"), name)
 
 def main():
     parser = argparse.ArgumentParser(description="Extract content per page from IDML.")
     parser.add_argument("idml_file", help="Path to .idml file")
     args = parser.parse_args()
 
-    temp_dir = tempfile.mkdtemp(prefix="idml_")
-    print(f"⏳ Extracting to: {temp_dir}")
-    if not extract_idml(args.idml_file, temp_dir):
-        shutil.rmtree(temp_dir)
+    # Spread and Story members are parsed straight from the archive, nothing is extracted to disk.
+    # This handle is only used for listing; workers open their own (see open_idml).
+    print(f"⏳ Reading: {args.idml_file}")
+    try:
+        with zipfile.ZipFile(args.idml_file, 'r') as zip_ref:
+            member_names = zip_ref.namelist()
+    except Exception as e:
+        print(f"Reading IDML package failed: {e}")
         return
 
-    spreads_dir = os.path.join(temp_dir, "Spreads")
-    stories_dir = os.path.join(temp_dir, "Stories")
-
-    if not os.path.isdir(spreads_dir) or not os.path.isdir(stories_dir):
+    has_spreads = any(n.startswith(SPREADS_PREFIX) for n in member_names)
+    has_stories = any(n.startswith(STORIES_PREFIX) for n in member_names)
+    if not has_spreads or not has_stories:
         print("❌ Spreads or Stories folder missing from the IDML package.")
-        shutil.rmtree(temp_dir)
         return
 
     # This will store all page data, keyed by unique Page Self ID
     all_page_data_by_id = {}
-    story_cache = {} # Cache stories to avoid re-reading and parsing
 
-    spread_files = find_spread_files(spreads_dir)
+    spread_files = find_spread_files(member_names)
     if not spread_files:
         print("❌ No spread files found in the Spreads directory.")
-        shutil.rmtree(temp_dir)
         return
 
-    for spread_file in spread_files:
-        spread_name = os.path.basename(spread_file)
-        print(f"📄 Processing Spread: {spread_name}")
-        
-        # Get content for pages within this specific spread
-        content_from_spread = get_page_content_from_spread(spread_file, stories_dir, story_cache)
-        
-        for pid, pdata_in_spread in content_from_spread.items():
-            if pid not in all_page_data_by_id:
-                # Initialize page data if this page ID is encountered for the first time
-                all_page_data_by_id[pid] = {
-                    "name": pdata_in_spread["name"], 
-                    "images": [], 
-                    "texts": []
-                }
-            
-            # Aggregate images, ensuring no duplicates
-            for img_uri in pdata_in_spread["images"]:
-                if img_uri not in all_page_data_by_id[pid]["images"]:
-                    all_page_data_by_id[pid]["images"].append(img_uri)
-            
-            # Aggregate texts, ensuring no duplicate story objects for the same page
-            current_story_ids_on_page = {t['story_id'] for t in all_page_data_by_id[pid]["texts"]}
-            for text_item in pdata_in_spread["texts"]:
-                if text_item['story_id'] not in current_story_ids_on_page:
-                    all_page_data_by_id[pid]["texts"].append(text_item)
-                    # No need to add to current_story_ids_on_page here as it's rebuilt on next page if needed
-
-    print("\n\n--- ✨ Consolidated Content Per Page ✨ ---")
+    # Spreads are independent, so they are parsed in parallel (each worker keeps its own
+    # story cache); results and logs are consumed in the original file order.
+    print(f"📄 Processing {len(spread_files)} spread(s)")
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        spread_results = executor.map(functools.partial(process_spread_file, idml_path=args.idml_file), spread_files)
+        for content_from_spread, spread_log in spread_results:
+            sys.stdout.write(spread_log) # Only errors are logged per spread
+            aggregate_spread_content(all_page_data_by_id, content_from_spread)
+
+    # The report is collected as lines and written to stdout in one go
+    lines = ["\n\n--- ✨ Consolidated Content Per Page ✨ ---"]
     if not all_page_data_by_id:
-        print("No content found on any pages.")
+        lines.append("No content found on any pages.")
 
-    # Sort pages for consistent output, e.g., by name.
+    # Sort pages for consistent output, by name with numeric names in numeric order ("2" before "10").
     # True document order might require parsing designmap.xml
-    sorted_page_ids = sorted(all_page_data_by_id.keys(), key=lambda page_id_key: all_page_data_by_id[page_id_key]["name"])
+    sorted_pages = sorted((page_name_key(pdata.name), pid, pdata) for pid, pdata in all_page_data_by_id.items())
 
-    for pid in sorted_page_ids:
-        pdata = all_page_data_by_id[pid]
-        print(f"\n--- Page \"{pdata['name']}\" (ID: {pid}) ---")
+    for _, pid, pdata in sorted_pages:
+        lines.append(f"\n--- Page \"{pdata.name}\" (ID: {pid}) ---")
         
-        if pdata["texts"]:
-            print("📝 Texts:")
-            for t in pdata["texts"]:
+        if pdata.texts:
+            lines.append("📝 Texts:")
+            for t in pdata.texts:
                 # Limit long text preview for conciseness in terminal
-                content_preview = (t['content'][:150] + '...') if len(t['content']) > 150 else t['content']
-                print(f"  Story ID: {t['story_id']}\n  Content: {content_preview}\n")
+                content_preview = (t.content[:150] + '...') if len(t.content) > 150 else t.content
+                lines.append(f"  Story ID: {t.story_id}\n  Content: {content_preview}\n")
         else:
-            print("📝 Texts: None")
+            lines.append("📝 Texts: None")
             
-        if pdata["images"]:
-            print("🖼 Images:")
-            for img_uri in pdata["images"]:
-                print(f"  - {img_uri}")
+        if pdata.images:
+            lines.append("🖼 Images:")
+            lines.extend(f"  - {img_uri}" for img_uri in pdata.images)
         else:
-            print("🖼 Images: None")
+            lines.append("🖼 Images: None")
 
-    print("\n✅ Done. Cleaning up...")
-    shutil.rmtree(temp_dir)
+    lines.append("\n✅ Done.")
+    sys.stdout.write("\n".join(lines) + "\n")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,41 @@
 import zipfile
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
 import os
 import argparse
-import shutil
-import tempfile
 import re
-import math
 import json
+import logging
+import sys
+import io
+import contextlib
+import concurrent.futures
+import functools
+import threading
+import numpy as np
+try: import orjson
+except ImportError: orjson = None # orjson is optional; json writes the same layout
+
+logger = logging.getLogger(__name__) # Per-item tracing is logged at DEBUG; enable with --verbose
+
+_RE_WS_NL = re.compile(r'\s*\n\s*') # \s also matches '\n', so this collapses any whitespace run holding a newline
+
+# --- Parser and compiled XPaths (IDML content elements carry no namespace; only the idPkg:* wrappers do) ---
+SPREAD_PARSE_OPTIONS = {"collect_ids": False, "remove_comments": True, "remove_pis": True} # For iterparse over spreads
+_XP_PROPS_PATH_POINT_ARRAY = ET.XPath('.//Properties/PathGeometry/GeometryPathType/PathPointArray')
+_XP_PATH_POINT_ARRAY = ET.XPath('.//PathGeometry/GeometryPathType/PathPointArray')
+_XP_GB = ET.XPath('.//Properties/GraphicBounds')
+_XP_LINK = ET.XPath('.//Link')
+_XP_ANCHORS = ET.XPath('PathPointType/@Anchor')
+
+_TAG_CACHE = {}
+def localname(tag, cache=_TAG_CACHE):
+    # '{ns}Tag' -> 'Tag', memoized: documents use a handful of distinct tags, so after warm-up this is one dict hit
+    name = cache.get(tag)
+    if name is None: name = cache[tag] = sys.intern(tag.rpartition('}')[2])
+    return name
+
+SPREADS_PREFIX = "Spreads/"
+STORIES_PREFIX = "Stories/"
 
 # --- Helper Functions for Geometry and Transforms ---
 def parse_transform_matrix(transform_str):
@@ -25,367 +54,489 @@ def parse_geometric_bounds(bounds_str):
     except ValueError: pass
     return (0.0, 0.0, 0.0, 0.0)
 
-def multiply_matrices(m1, m2):
-    a1, b1, c1, d1, tx1, ty1 = m1; a2, b2, c2, d2, tx2, ty2 = m2
-    return (a1*a2+c1*b2, b1*a2+d1*b2, a1*c2+c1*d2, b1*c2+d1*d2, a1*tx2+c1*ty2+tx1, b1*tx2+d1*ty2+ty1)
-
-def apply_transform_to_point(x, y, matrix):
-    a, b, c, d, tx, ty = matrix
-    return (a*x+c*y+tx, b*x+d*y+ty)
-
-def get_global_corners(local_bounds, item_global_matrix): # Renamed from global_item_matrix for clarity
-    y1, x1, y2, x2 = local_bounds
-    return [
-        apply_transform_to_point(x1, y1, item_global_matrix), apply_transform_to_point(x2, y1, item_global_matrix),
-        apply_transform_to_point(x1, y2, item_global_matrix), apply_transform_to_point(x2, y2, item_global_matrix)
-    ]
-
-def get_axis_aligned_bounding_box(corners):
-    if not corners: return {"x1":0.0,"y1":0.0,"x2":0.0,"y2":0.0}
-    all_x=[p[0] for p in corners]; all_y=[p[1] for p in corners]
-    return {"x1":min(all_x),"y1":min(all_y),"x2":max(all_x),"y2":max(all_y)}
-
-def get_item_center(global_aabb):
-    return ((global_aabb["x1"]+global_aabb["x2"])/2.0, (global_aabb["y1"]+global_aabb["y2"])/2.0)
-
-def is_point_in_rect(px, py, rect_y1, rect_x1, rect_y2, rect_x2): # CORRECTED
-    return (rect_x1 <= px <= rect_x2) and \
-           (rect_y1 <= py <= rect_y2)
+def corners_aabb(y1, x1, y2, x2, a, b, c, d, tx, ty):
+    # Transforms the four corners of (y1, x1, y2, x2) and returns their AABB as (x1, y1, x2, y2), with no intermediate lists
+    px=a*x1+c*y1+tx; py=b*x1+d*y1+ty; minx=maxx=px; miny=maxy=py
+    px=a*x2+c*y1+tx; py=b*x2+d*y1+ty; minx=min(minx,px); maxx=max(maxx,px); miny=min(miny,py); maxy=max(maxy,py)
+    px=a*x1+c*y2+tx; py=b*x1+d*y2+ty; minx=min(minx,px); maxx=max(maxx,px); miny=min(miny,py); maxy=max(maxy,py)
+    px=a*x2+c*y2+tx; py=b*x2+d*y2+ty; minx=min(minx,px); maxx=max(maxx,px); miny=min(miny,py); maxy=max(maxy,py)
+    return (minx, miny, maxx, maxy)
 
 class PageGeometricInfo:
+    __slots__ = ("id", "name", "local_bounds", "a", "b", "c", "d", "tx", "ty", "global_aabb") # Pickled across the spread process pool
     def __init__(self, self_id, name, page_local_transform_str, page_local_bounds_str, spread_base_transform_matrix): # MODIFIED
         self.id = self_id
         self.name = name
         
-        page_local_matrix = parse_transform_matrix(page_local_transform_str)
+        a2, b2, c2, d2, tx2, ty2 = parse_transform_matrix(page_local_transform_str)
         self.local_bounds = parse_geometric_bounds(page_local_bounds_str) # These are page's own geometric bounds
         
         # Calculate the page's true global matrix by applying the spread's base transform to the page's local transform
-        self.global_matrix = multiply_matrices(spread_base_transform_matrix, page_local_matrix)
+        a1, b1, c1, d1, tx1, ty1 = spread_base_transform_matrix
+        self.a, self.b, self.c, self.d = a1*a2+c1*b2, b1*a2+d1*b2, a1*c2+c1*d2, b1*c2+d1*d2
+        self.tx, self.ty = a1*tx2+c1*ty2+tx1, b1*tx2+d1*ty2+ty1
         
-        # Calculate global AABB of the page using the page's local bounds and its true global_matrix
-        page_global_corners = get_global_corners(self.local_bounds, self.global_matrix)
-        self.global_aabb = get_axis_aligned_bounding_box(page_global_corners)
+        # Calculate global AABB of the page using the page's local bounds and its true global matrix
+        self.global_aabb = corners_aabb(*self.local_bounds, self.a, self.b, self.c, self.d, self.tx, self.ty)
         
-        print(f"  Page '{self.name}' (ID: {self.id}): "
-              # f"LocalTransform={page_local_matrix}, SpreadBaseM={spread_base_transform_matrix}, "
-              f"FinalGlobalMatrix={tuple(f'{x:.2f}' for x in self.global_matrix)}, "
-              f"Global AABB=(x1: {self.global_aabb['x1']:.2f}- x2: {self.global_aabb['x2']:.2f}, "
-              f"y1: {self.global_aabb['y1']:.2f}- y2:{self.global_aabb['y2']:.2f})")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"  Page '{self.name}' (ID: {self.id}): "
+                  # f"LocalTransform={page_local_matrix}, SpreadBaseM={spread_base_transform_matrix}, "
+                  f"FinalGlobalMatrix={tuple(f'{x:.2f}' for x in self.global_matrix)}, "
+                  f"Global AABB=(x1: {self.global_aabb[0]:.2f}- x2: {self.global_aabb[2]:.2f}, "
+                  f"y1: {self.global_aabb[1]:.2f}- y2:{self.global_aabb[3]:.2f})")
+
+    @property
+    def global_matrix(self): return (self.a, self.b, self.c, self.d, self.tx, self.ty)
+
+
+class TextFrameRecord:
+    """A text frame placed on a page, with the text of its story."""
+    __slots__ = ("story_id", "text_frame_id", "content", "global_bounds", "item_transform")
+
+    def __init__(self, story_id, text_frame_id, content, global_bounds, item_transform):
+        self.story_id = story_id
+        self.text_frame_id = text_frame_id
+        self.content = content
+        self.global_bounds = global_bounds
+        self.item_transform = item_transform
+
+class ImageRecord:
+    """A linked image placed on a page, with the frame that contains it."""
+    __slots__ = ("uri", "image_element_id", "container_element_tag", "container_element_id", "global_bounds", "item_transform")
+
+    def __init__(self, uri, image_element_id, container_element_tag, container_element_id, global_bounds, item_transform):
+        self.uri = uri
+        self.image_element_id = image_element_id
+        self.container_element_tag = container_element_tag
+        self.container_element_id = container_element_id
+        self.global_bounds = global_bounds
+        self.item_transform = item_transform
 
 
 def get_local_bounds_from_path_geometry(tf_element):
-    path_point_array = tf_element.find('.//{*}Properties/{*}PathGeometry/{*}GeometryPathType/{*}PathPointArray')
-    if path_point_array is None:
-        path_point_array = tf_element.find('.//{*}PathGeometry/{*}GeometryPathType/{*}PathPointArray')
-        if path_point_array is None: return None
-    all_x=[]; all_y=[]
-    for path_point_type in path_point_array.findall('{*}PathPointType'):
-        anchor_str = path_point_type.get("Anchor")
-        if anchor_str:
-            try:
-                coords = list(map(float, anchor_str.split()))
-                if len(coords) == 2: all_x.append(coords[0]); all_y.append(coords[1])
-            except ValueError: continue
+    path_point_arrays = _XP_PROPS_PATH_POINT_ARRAY(tf_element) or _XP_PATH_POINT_ARRAY(tf_element)
+    if not path_point_arrays: return None
+    anchor_pairs = [anchor_str.split() for anchor_str in _XP_ANCHORS(path_point_arrays[0])]
+    if anchor_pairs and all(len(pair) == 2 for pair in anchor_pairs):
+        try: # Well-formed "x y" anchors convert to floats in one NumPy pass
+            xy = np.array(anchor_pairs, dtype=np.float64); lo = xy.min(axis=0).tolist(); hi = xy.max(axis=0).tolist()
+            return (lo[1], lo[0], hi[1], hi[0])
+        except ValueError: pass
+    all_x=[]; all_y=[] # Otherwise skip each malformed anchor on its own
+    for pair in anchor_pairs:
+        try:
+            coords = list(map(float, pair))
+            if len(coords) == 2: all_x.append(coords[0]); all_y.append(coords[1])
+        except ValueError: continue
     if not all_x or not all_y: return None
     return (min(all_y), min(all_x), max(all_y), max(all_x))
 
 # --- Main Extraction Logic ---
-def extract_idml(idml_path, extract_to):
-    try:
-        with zipfile.ZipFile(idml_path, 'r') as zf: zf.extractall(extract_to)
-        print(f"✅ Successfully extracted IDML to {extract_to}"); return True
-    except Exception as e: print(f"❌ Extraction failed: {e}"); return False
+@functools.lru_cache(maxsize=None)
+def worker_idml(idml_path):
+    """The package handle of a spread pool worker, opened on its first spread and reused for the rest.
+    Only ever called inside pool workers, which exit with the pool; extract() opens and closes its own handle."""
+    return zipfile.ZipFile(idml_path, 'r')
+
+_story_thread = threading.local()
+
+def open_story_idml(idml_path, handles):
+    """Story pool initializer: each thread reads stories through its own package handle, since ZipFile.open
+    is not thread-safe on a shared one. handles collects them so collect_spreads can close them afterwards."""
+    _story_thread.zf = zipfile.ZipFile(idml_path, 'r'); handles.append(_story_thread.zf)
+
+def read_story_text(story_path):
+    # Story pool task; see open_story_idml
+    return get_story_text(_story_thread.zf, story_path)
+
+def release_element(element):
+    # Used on story Content/Br and on finished top-level spread children: empty the element and unlink what came before it
+    element.clear()
+    while element.getprevious() is not None: del element.getparent()[0]
 
-def get_story_text(story_path):
+def get_story_text(zf, story_path):
     text_content_segments = []
     try:
-        tree = ET.parse(story_path)
-        root = tree.getroot()
-        for element in root.iter():
-            tag_name = element.tag.split('}')[-1]
-            if tag_name == 'Content' and element.text: text_content_segments.append(element.text)
-            elif tag_name == 'Br': text_content_segments.append('\n')
+        with zf.open(story_path) as story_file:
+            # Stream; libxml2 filters for Content/Br itself so only those two tags reach Python
+            for _, element in ET.iterparse(story_file, events=('end',), tag=('Content','Br')):
+                if element.tag == 'Content':
+                    if element.text: text_content_segments.append(element.text)
+                else: text_content_segments.append('\n')
+                release_element(element)
         full_text = "".join(text_content_segments)
-        full_text = re.sub(r'\s*\n\s*','\n',full_text); full_text = re.sub(r'\n{2,}','\n',full_text).strip()
-        if not full_text and os.path.exists(story_path): print(f"    ℹ️ Story {os.path.basename(story_path)}: No text content extracted.")
-        return full_text
-    except ET.ParseError as e: print(f"    ❌ ERROR PARSING STORY XML {os.path.basename(story_path)}: {e}"); return ""
-    except Exception as e: print(f"    ❌ UNEXPECTED ERROR in get_story_text for {os.path.basename(story_path)}: {e}"); return ""
-
-def find_page_for_item_center(item_id, item_tag, item_center_x, item_center_y, geometric_pages): # Added item_id and item_tag for logging
-    print(f"    DEBUG find_page: Item <{item_tag} ID:{item_id}> Checking point ({item_center_x:.2f}, {item_center_y:.2f})") 
-    for i, page_info in enumerate(geometric_pages):
-        print(f"      DEBUG find_page: vs Page '{page_info.name}' (ID: {page_info.id}) AABB: x:[{page_info.global_aabb['x1']:.2f}-{page_info.global_aabb['x2']:.2f}], y:[{page_info.global_aabb['y1']:.2f}-{page_info.global_aabb['y2']:.2f}]")
-        if is_point_in_rect(item_center_x, item_center_y,
-                              page_info.global_aabb["y1"], page_info.global_aabb["x1"],
-                              page_info.global_aabb["y2"], page_info.global_aabb["x2"]):
-            print(f"      DEBUG find_page: MATCH! Item <{item_tag} ID:{item_id}> assigned to Page {page_info.id}") 
-            return page_info.id
-    print(f"    DEBUG find_page: No page match for Item <{item_tag} ID:{item_id}> at point ({item_center_x:.2f}, {item_center_y:.2f})") 
-    return None
-
-def process_spread_element_recursively(element, parent_element, current_accumulated_matrix,
-                                       geometric_pages, pages_content_map,
-                                       stories_dir, story_cache, depth=0):
-    indent = "  " * (depth+1) 
-    element_tag_local = element.tag.split('}')[-1]
-    element_id = element.get("Self", "UnknownID")
-    print(f"{indent}Processing <{element_tag_local} ID:{element_id}> LocalTransform: {element.get('ItemTransform')}") 
-
-    item_local_matrix_str = element.get("ItemTransform")
-    item_local_matrix = parse_transform_matrix(item_local_matrix_str)
-    item_global_matrix = multiply_matrices(current_accumulated_matrix, item_local_matrix)
-    print(f"{indent}  GlobalMatrix for {element_id}: {tuple(f'{x:.2f}' for x in item_global_matrix)}") 
+        return _RE_WS_NL.sub('\n',full_text).strip() # An empty story is reported by resolve_story_texts
+    except ET.ParseError as e: print(f"    ❌ ERROR PARSING STORY XML {os.path.basename(story_path)}: {e}"); return None
+    except Exception as e: print(f"    ❌ UNEXPECTED ERROR in get_story_text for {os.path.basename(story_path)}: {e}"); return None
 
+def build_page_table(geometric_pages):
+    """Stacks the pages' global AABBs into an (N, 4) [x1, y1, x2, y2] array, paired with their ids."""
+    aabbs = np.array([p.global_aabb for p in geometric_pages], dtype=np.float64).reshape(-1, 4)
+    return aabbs, [p.id for p in geometric_pages]
+
+def new_spread_items():
+    # Structure-of-arrays collected by the XML walk; geometry for all of them is computed in one batch afterwards.
+    # node_* columns hold every walked container and item (local matrix, parent node index, depth); "nodes" maps items to them.
+    return {"tags":[],"ids":[],"bounds":[],"nodes":[],"transforms":[],"extras":[],"depths":[],
+            "node_ids":[],"node_matrices":[],"node_parents":[],"node_depths":[]}
+
+def image_item(element, parent_tag_local, parent_id, element_id, indent, debug):
+    # (extra, local bounds) for an Image with a linked resource; None otherwise
+    le_matches=_XP_LINK(element); le=le_matches[0] if le_matches else None
+    uri = le.get("LinkResourceURI") if le is not None else None
+    if not uri: return None
     determined_local_bounds = (0.0,0.0,0.0,0.0)
-    if element_tag_local == 'Image':
-        gb_prop = element.find('.//{*}Properties/{*}GraphicBounds')
-        if gb_prop is not None:
-            try:
-                gb_l,gb_t,gb_r,gb_b = (float(gb_prop.get(s,"0")) for s in ["Left","Top","Right","Bottom"])
-                determined_local_bounds = (gb_t, gb_l, gb_b, gb_r) 
-                # print(f"{indent}  Image ID: {element_id} using GraphicBounds: {determined_local_bounds}")
-            except Exception as e: print(f"{indent}  ⚠️ Error parsing GraphicBounds for Image {element_id}: {e}")
-        if determined_local_bounds == (0.0,0.0,0.0,0.0): 
-            item_lbs_img = element.get("GeometricBounds"); 
-            if item_lbs_img: determined_local_bounds = parse_geometric_bounds(item_lbs_img)
-    elif element_tag_local == "TextFrame":
-        path_gb = get_local_bounds_from_path_geometry(element)
-        if path_gb: determined_local_bounds = path_gb; print(f"{indent}  TextFrame ID: {element_id} using PathGeometry bounds: {tuple(f'{x:.2f}' for x in determined_local_bounds)}")
-        else:
-            lbs_tf = element.get("GeometricBounds")
-            if lbs_tf: determined_local_bounds = parse_geometric_bounds(lbs_tf)
-            # else: print(f"{indent}  TextFrame ID: {element_id} no PathGeometry or GeoBounds. Local bounds 0.")
-    else: determined_local_bounds = parse_geometric_bounds(element.get("GeometricBounds"))
-    
-    item_global_aabb={"x1":0.0,"y1":0.0,"x2":0.0,"y2":0.0} 
-    item_center_x,item_center_y = item_global_matrix[4],item_global_matrix[5]
-    if determined_local_bounds != (0.0,0.0,0.0,0.0):
-        igc = get_global_corners(determined_local_bounds,item_global_matrix)
-        item_global_aabb = get_axis_aligned_bounding_box(igc)
-        item_center_x,item_center_y = get_item_center(item_global_aabb)
-        # print(f"{indent}  Item ID: {element_id} LocalBounds: {determined_local_bounds} -> GlobalAABB & Center calculated")
-    
-    assigned_page_id = find_page_for_item_center(element_id, element_tag_local, item_center_x, item_center_y, geometric_pages)
-    
-    if element_tag_local == "TextFrame":
-        story_id = element.get("ParentStory")
-        # print(f"{indent}  TF {element_id} (Story: {story_id}), Center: ({item_center_x:.1f},{item_center_y:.1f}), AssignedPage: {assigned_page_id}")
-        if assigned_page_id and story_id:
-            if story_id not in story_cache:
-                sfn=f"Story_{story_id}.xml"; sfp=os.path.join(stories_dir,sfn)
-                if os.path.exists(sfp): story_cache[story_id]=get_story_text(sfp)
-                else: story_cache[story_id]=""; print(f"{indent}    ❌ Story file {sfn} NOT FOUND for TF {element_id}")
-            tc=story_cache.get(story_id,""); pd=pages_content_map.get(assigned_page_id)
-            # print(f"{indent}    TF {element_id} on Page {assigned_page_id}: PageDataOk: {pd is not None}. TextLen: {len(tc)}. Story: {story_id}")
-            if pd:
-                if not any(tf['text_frame_id']==element_id for tf in pd["texts"]):
-                    if tc:
-                        pd["texts"].append({"story_id":story_id,"text_frame_id":element_id,"content":tc,"global_bounds":item_global_aabb,"item_transform":item_local_matrix_str})
-                        print(f"{indent}    ✅ Added TextFrame ID: {element_id} (Story: {story_id}) to Page ID: {assigned_page_id}.")
-                    elif story_id in story_cache: print(f"{indent}    ℹ️ TF {element_id} (Story: {story_id}) has empty text_content, not adding.")
-        elif story_id: print(f"{indent}  ⚠️ TF {element_id} (Story {story_id}) at C:({item_center_x:.1f},{item_center_y:.1f}) NOT assigned to page.")
-    elif element_tag_local == "Image":
-        if assigned_page_id:
-            le=element.find('.//{*}Link')
-            if le is not None:
-                uri=le.get("LinkResourceURI")
-                if uri:
-                    pd=pages_content_map.get(assigned_page_id)
-                    if pd:
-                        ctag=parent_element.tag.split('}')[-1] if parent_element else "Unk"; cid=parent_element.get("Self","Unk") if parent_element else "Unk"
-                        if not any(i['uri']==uri and i['image_element_id']==element_id for i in pd["images"]):
-                            pd["images"].append({"uri":uri,"image_element_id":element_id,"container_element_tag":ctag,"container_element_id":cid,"global_bounds":item_global_aabb,"item_transform":item_local_matrix_str})
-                            # print(f"{indent}  🖼️ Added Image Link: '{uri}' (ID: {element_id}) to Page ID: {assigned_page_id}.")
-    if element_tag_local in ["Group","Rectangle","Oval","Polygon"]:
-        for child in element: process_spread_element_recursively(child,element,item_global_matrix,geometric_pages,pages_content_map,stories_dir,story_cache,depth+1)
-
-def get_page_content_from_spread(spread_path, stories_dir, story_cache): # MODIFIED
+    gb_matches = _XP_GB(element); gb_prop = gb_matches[0] if gb_matches else None
+    if gb_prop is not None:
+        try:
+            gb_l,gb_t,gb_r,gb_b = (float(gb_prop.get(s,"0")) for s in ["Left","Top","Right","Bottom"])
+            determined_local_bounds = (gb_t, gb_l, gb_b, gb_r) 
+            # print(f"{indent}  Image ID: {element_id} using GraphicBounds: {determined_local_bounds}")
+        except Exception as e: logger.warning(f"{indent}  ⚠️ Error parsing GraphicBounds for Image {element_id}: {e}")
+    if determined_local_bounds == (0.0,0.0,0.0,0.0): 
+        item_lbs_img = element.get("GeometricBounds"); 
+        if item_lbs_img: determined_local_bounds = parse_geometric_bounds(item_lbs_img)
+    return (uri, parent_tag_local, parent_id), determined_local_bounds
+
+def text_frame_item(element, parent_tag_local, parent_id, element_id, indent, debug):
+    # (story id, local bounds) for a TextFrame attached to a story; None otherwise
+    story_id = element.get("ParentStory")
+    if not story_id: return None
+    story_id = sys.intern(story_id) # Many frames share a story; one string per id, used as a dict key downstream
+    determined_local_bounds = get_local_bounds_from_path_geometry(element)
+    if determined_local_bounds:
+        if debug: logger.debug(f"{indent}  TextFrame ID: {element_id} using PathGeometry bounds: {tuple(f'{x:.2f}' for x in determined_local_bounds)}")
+    else:
+        lbs_tf = element.get("GeometricBounds")
+        determined_local_bounds = parse_geometric_bounds(lbs_tf) if lbs_tf else (0.0,0.0,0.0,0.0)
+        # if not lbs_tf: print(f"{indent}  TextFrame ID: {element_id} no PathGeometry or GeoBounds. Local bounds 0.")
+    return story_id, determined_local_bounds
+
+_ITEM_HANDLERS = {"Image": image_item, "TextFrame": text_frame_item} # Tag dispatch for items that can reach the output
+_CONTAINER_TAGS = frozenset(("Group","Rectangle","Oval","Polygon"))
+
+_WALK_TAGS = ("Group","Rectangle","Oval","Polygon","Image","TextFrame") # Everything else is skipped by lxml's iter in C
+
+def walk_spread_item(top_element, spread_tag_local, spread_id, items):
+    # One document-order pass over a top-level spread item, recording nodes for the batched geometry. Each container's
+    # node is keyed by the element, so a child finds its parent's without recursion; only children of containers are walked.
+    debug = logger.isEnabledFor(logging.DEBUG) # Checked once so disabled traces cost no formatting
+    frames = {top_element.getparent(): (-1, -1, spread_tag_local, spread_id)} # Node -1 is the spread itself
+    for element in top_element.iter(_WALK_TAGS):
+        frame = frames.get(element.getparent())
+        if frame is None: continue # Nested under something that is not a walked container
+        parent_node, parent_depth, parent_tag_local, parent_id = frame
+        depth = parent_depth+1; indent = "  " * (depth+1) 
+        element_tag_local = localname(element.tag)
+        element_id = element.get("Self", "UnknownID")
+        item_local_matrix_str = element.get("ItemTransform")
+        if debug: logger.debug(f"{indent}Processing <{element_tag_local} ID:{element_id}> LocalTransform: {item_local_matrix_str}") 
+
+        handler = _ITEM_HANDLERS.get(element_tag_local)
+        item = handler(element, parent_tag_local, parent_id, element_id, indent, debug) if handler else None
+        is_container = element_tag_local in _CONTAINER_TAGS
+        if not item and not is_container: continue
+        node = len(items["node_ids"])
+        items["node_ids"].append(element_id); items["node_matrices"].append(parse_transform_matrix(item_local_matrix_str))
+        items["node_parents"].append(parent_node); items["node_depths"].append(depth)
+        if item: # Only linked images and story-backed text frames can reach the output
+            extra, determined_local_bounds = item
+            items["tags"].append(element_tag_local); items["ids"].append(element_id); items["extras"].append(extra)
+            items["bounds"].append(determined_local_bounds); items["nodes"].append(node)
+            items["transforms"].append(item_local_matrix_str); items["depths"].append(depth)
+        if is_container: frames[element] = (node, depth, element_tag_local, element_id)
+
+def compute_global_matrices(items, spread_base_matrix):
+    """Accumulated (a, b, c, d, tx, ty) matrix of every walked node as an (N, 6) array, composed one depth level at a time."""
+    local = np.asarray(items["node_matrices"], dtype=np.float64).reshape(-1, 6)
+    parents = np.asarray(items["node_parents"], dtype=np.intp); depths = np.asarray(items["node_depths"], dtype=np.intp)
+    glob = np.empty((len(local)+1, 6), dtype=np.float64); glob[-1] = spread_base_matrix # Parent index -1 picks up the spread
+    for depth in range(int(depths.max(initial=-1))+1): # Parents always sit one level up, so each level is one batch
+        level = np.flatnonzero(depths == depth)
+        pa, pb, pc, pd_, ptx, pty = glob[parents[level]].T; la, lb, lc, ld, ltx, lty = local[level].T
+        glob[level] = np.stack([pa*la+pc*lb, pb*la+pd_*lb, pa*lc+pc*ld, pb*lc+pd_*ld, pa*ltx+pc*lty+ptx, pb*ltx+pd_*lty+pty], axis=1)
+    glob = glob[:-1]
+    if logger.isEnabledFor(logging.DEBUG):
+        for element_id, depth, m in zip(items["node_ids"], items["node_depths"], glob.tolist()):
+            logger.debug(f"{'  ' * (depth+1)}  GlobalMatrix for {element_id}: {tuple(f'{x:.2f}' for x in m)}")
+    return glob
+
+def compute_item_geometry(items, spread_base_matrix, page_table):
+    """Global AABBs, centers and assigned page ids for every collected item, computed as whole-array operations."""
+    lb = np.asarray(items["bounds"], dtype=np.float64).reshape(-1, 4)
+    m = compute_global_matrices(items, spread_base_matrix)[np.asarray(items["nodes"], dtype=np.intp)]
+    y1, x1, y2, x2 = lb.T; a, b, c, d, tx, ty = m.T
+    xs = np.stack([a*x1+c*y1+tx, a*x2+c*y1+tx, a*x1+c*y2+tx, a*x2+c*y2+tx], axis=1)
+    ys = np.stack([b*x1+d*y1+ty, b*x2+d*y1+ty, b*x1+d*y2+ty, b*x2+d*y2+ty], axis=1)
+    has_bounds = lb.any(axis=1) # Items without local bounds keep a zero AABB and use the transformed origin as center
+    aabbs = np.where(has_bounds[:,None], np.stack([xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=1), 0.0)
+    cx = np.where(has_bounds, (aabbs[:,0]+aabbs[:,2])/2.0, tx); cy = np.where(has_bounds, (aabbs[:,1]+aabbs[:,3])/2.0, ty)
+    page_aabbs, page_ids = page_table # Point-in-page for every item against every page at once; the first containing page wins
+    inside = ((page_aabbs[:,0] <= cx[:,None]) & (cx[:,None] <= page_aabbs[:,2]) &
+              (page_aabbs[:,1] <= cy[:,None]) & (cy[:,None] <= page_aabbs[:,3]))
+    first = inside.argmax(axis=1).tolist(); hit = inside.any(axis=1).tolist()
+    assigned = [page_ids[i] if h else None for i, h in zip(first, hit)]
+    return list(map(tuple, aabbs.tolist())), cx.tolist(), cy.tolist(), assigned
+
+def assign_items_to_pages(items, spread_base_matrix, page_table, pages_content_map):
+    debug = logger.isEnabledFor(logging.DEBUG)
+    aabbs, cxs, cys, assigned = compute_item_geometry(items, spread_base_matrix, page_table)
+    for tag, element_id, extra, item_local_matrix_str, depth, item_global_aabb, item_center_x, item_center_y, assigned_page_id in zip(
+            items["tags"], items["ids"], items["extras"], items["transforms"], items["depths"], aabbs, cxs, cys, assigned):
+        indent = "  " * (depth+1)
+        if tag == "TextFrame":
+            story_id = extra
+            # print(f"{indent}  TF {element_id} (Story: {story_id}), Center: ({item_center_x:.1f},{item_center_y:.1f}), AssignedPage: {assigned_page_id}")
+            if assigned_page_id:
+                pd=pages_content_map.get(assigned_page_id)
+                # print(f"{indent}    TF {element_id} on Page {assigned_page_id}: PageDataOk: {pd is not None}. Story: {story_id}")
+                if pd and element_id not in pd["_text_ids"]: # Content is filled in by the parent process, see resolve_story_texts
+                    pd["_text_ids"].add(element_id)
+                    pd["texts"].append(TextFrameRecord(story_id,element_id,None,item_global_aabb,item_local_matrix_str))
+            elif debug: logger.debug(f"{indent}  ⚠️ TF {element_id} (Story {story_id}) at C:({item_center_x:.1f},{item_center_y:.1f}) NOT assigned to page.")
+        elif assigned_page_id:
+            uri, ctag, cid = extra
+            pd=pages_content_map.get(assigned_page_id)
+            if pd and (uri,element_id) not in pd["_image_keys"]:
+                pd["_image_keys"].add((uri,element_id))
+                pd["images"].append(ImageRecord(uri,element_id,ctag,cid,item_global_aabb,item_local_matrix_str))
+                # print(f"{indent}  🖼️ Added Image Link: '{uri}' (ID: {element_id}) to Page ID: {assigned_page_id}.")
+
+def get_page_content_from_spread(zf, spread_path): # MODIFIED
+    # Streams the spread: the main <Spread> is the parent of the first <Page>, and each of its direct children is handled
+    # as soon as it is closed, then released, so the whole spread tree is never held in memory at once.
+    current_spread_pages_content = {}; geometric_pages = []; items = new_spread_items()
+    spread_element = None
+
+    def take_spread_child(child_el):
+        ct_local = localname(child_el.tag)
+        if ct_local == "Page":
+            pid=child_el.get("Self"); name=child_el.get("Name",f"UnkPage_{pid}")
+            if pid:
+                pid = sys.intern(pid)
+                # Pass spread_base_matrix to PageGeometricInfo
+                page_info=PageGeometricInfo(pid, name, child_el.get("ItemTransform"), child_el.get("GeometricBounds"), spread_base_matrix)
+                geometric_pages.append(page_info)
+                if pid not in current_spread_pages_content:
+                    # _text_ids/_image_keys are dedup side-tables; they never reach the JSON output
+                    current_spread_pages_content[pid] = {"name":name,"images":[],"texts":[],"_text_ids":set(),"_image_keys":set()}
+        elif ct_local not in ("FlattenerPreference","Properties"):
+            walk_spread_item(child_el,spread_tag_local,spread_id,items)
+        release_element(child_el) # Subtree fully processed; free it (and the siblings before it)
+
     try:
-        tree = ET.parse(spread_path); root = tree.getroot(); spread_element = root
-        if not spread_element.tag.endswith('Spread') or not any(c.tag.split('}')[-1]=='Page' for c in spread_element):
-            candidate = spread_element.find('{*}Spread') 
-            if candidate is not None and any(c.tag.split('}')[-1]=='Page' for c in candidate): spread_element = candidate
-            else:
-                found_spreads = [el for el in root.iter() if el.tag.endswith('Spread') and any(c.tag.split('}')[-1]=='Page' for c in el)]
-                if found_spreads: spread_element = found_spreads[0]
-                else: print(f"  ❌ No main <Spread> with <Page> children in {os.path.basename(spread_path)}"); return {}
+        with zf.open(spread_path) as spread_file:
+            for _, element in ET.iterparse(spread_file, events=("end",), **SPREAD_PARSE_OPTIONS):
+                parent = element.getparent()
+                if parent is None: continue
+                if spread_element is None:
+                    if element.tag != "Page" or not parent.tag.endswith('Spread'): continue
+                    spread_element = parent; spread_tag_local = localname(parent.tag); spread_id = parent.get("Self","Unk")
+                    spread_base_matrix_str = parent.get("ItemTransform") # Get Spread's own transform
+                    spread_base_matrix = parse_transform_matrix(spread_base_matrix_str)
+                    print(f"  Processing Spread '{spread_id}'. Spread Base Matrix: {tuple(f'{x:.2f}' for x in spread_base_matrix)}")
+                    for earlier_el in reversed(list(element.itersiblings(preceding=True))): take_spread_child(earlier_el)
+                if parent is spread_element: take_spread_child(element)
     except Exception as e: print(f"  ❌ Error parsing {spread_path}: {e}"); return {}, []
+    if spread_element is None: print(f"  ❌ No main <Spread> with <Page> children in {os.path.basename(spread_path)}"); return {}, []
+    if not geometric_pages: print(f"  ℹ️ No Page elements found in {os.path.basename(spread_path)}."); return {}, []
 
-    current_spread_pages_content = {}; geometric_pages = []
-    spread_base_matrix_str = spread_element.get("ItemTransform") # Get Spread's own transform
-    spread_base_matrix = parse_transform_matrix(spread_base_matrix_str)
-    print(f"  Processing Spread '{spread_element.get('Self')}'. Spread Base Matrix: {tuple(f'{x:.2f}' for x in spread_base_matrix)}")
-
-    for page_el in spread_element.findall('.//{*}Page'):
-        pid=page_el.get("Self"); name=page_el.get("Name",f"UnkPage_{pid}")
-        if not pid: continue
-        # Pass spread_base_matrix to PageGeometricInfo
-        page_info=PageGeometricInfo(pid, name, page_el.get("ItemTransform"), page_el.get("GeometricBounds"), spread_base_matrix)
-        geometric_pages.append(page_info)
-        if pid not in current_spread_pages_content:
-             current_spread_pages_content[pid] = {"name":name,"images":[],"texts":[]}
-    if not geometric_pages: print(f"  ℹ️ No Page elements found in {os.path.basename(spread_path)}."); return {}
-    
-    for child_el in spread_element: 
-        ct_local = child_el.tag.split('}')[-1]
-        if ct_local in ["Page","FlattenerPreference","Properties"]: continue
-        # Pass spread_base_matrix as the initial current_accumulated_matrix for its direct children
-        process_spread_element_recursively(child_el,spread_element,spread_base_matrix,geometric_pages,
-                                           current_spread_pages_content,stories_dir,story_cache,0)
+    # spread_base_matrix is the accumulated matrix for the spread's direct children
+    assign_items_to_pages(items,spread_base_matrix,build_page_table(geometric_pages),current_spread_pages_content)
     return current_spread_pages_content, geometric_pages
 
-def find_spread_files(spreads_dir):
-    if not os.path.isdir(spreads_dir): return []
-    return [os.path.join(spreads_dir, f) for f in os.listdir(spreads_dir) if f.startswith("Spread_") and f.endswith(".xml")]
+def process_spread_file(spread_path, idml_path, log_level):
+    # Process-pool entry point; see collect_spread
+    return collect_spread(worker_idml(idml_path), spread_path, log_level)
+
+def collect_spread(zf, spread_path, log_level):
+    """Walks one spread of the open package zf; returns its page content, page geometry and the log it produced."""
+    spread_log = io.StringIO()
+    handler = logging.StreamHandler(spread_log); handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler); logger.setLevel(log_level); logger.propagate = False
+    try:
+        with contextlib.redirect_stdout(spread_log):
+            content, geometry = get_page_content_from_spread(zf, spread_path)
+    finally: logger.removeHandler(handler); logger.setLevel(logging.NOTSET); logger.propagate = True
+    return content, geometry, spread_log.getvalue()
+
+def submit_story_texts(pages_content, story_cache, story_pool, story_paths):
+    # Queues every story a spread's frames reference that is not queued yet; ids missing from the package map to None
+    for pdata in pages_content.values():
+        for t_item in pdata["texts"]:
+            story_id = t_item.story_id
+            if story_id not in story_cache:
+                story_path = story_paths.get(story_id)
+                story_cache[story_id] = story_pool.submit(read_story_text, story_path) if story_path else None
+
+def resolve_story_texts(pages_content, story_cache):
+    # Fills in the text of a spread's frames from the story threads; frames whose story is missing or empty are dropped.
+    # Each story is reported the first time it is resolved, so its notice lands under the first spread that uses it.
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for pid, pdata in pages_content.items():
+        texts = []
+        for t_item in pdata["texts"]:
+            story_id = t_item.story_id; tc = story_cache.get(story_id)
+            if tc is None: tc = story_cache[story_id] = ""; logger.warning(f"    ❌ Story file Story_{story_id}.xml NOT FOUND for TF {t_item.text_frame_id}")
+            elif isinstance(tc, concurrent.futures.Future):
+                tc = tc.result()
+                if tc == "": print(f"    ℹ️ Story Story_{story_id}.xml: No text content extracted.")
+                tc = story_cache[story_id] = tc or "" # None: the parse error was already printed
+            t_item.content = tc
+            if tc:
+                texts.append(t_item)
+                if debug: logger.debug(f"    ✅ Added TextFrame ID: {t_item.text_frame_id} (Story: {story_id}) to Page ID: {pid}.")
+            else:
+                pdata["_text_ids"].discard(t_item.text_frame_id)
+                if debug: logger.debug(f"    ℹ️ TF {t_item.text_frame_id} (Story: {story_id}) has empty text_content, not adding.")
+        pdata["texts"] = texts
+
+def find_story_paths(member_names):
+    # One scan of the package listing up front; story lookups on the hot path are then plain dict hits
+    prefix = STORIES_PREFIX + "Story_"
+    return {sys.intern(n[len(prefix):-4]): n for n in member_names if n.startswith(prefix) and n.endswith(".xml")}
+
+def find_spread_files(member_names):
+    return [n for n in member_names if n.startswith(SPREADS_PREFIX + "Spread_") and n.endswith(".xml")]
 
 def main():
     parser = argparse.ArgumentParser(description="Extract content per page from IDML.")
     parser.add_argument("idml_file", help="Path to .idml file")
     parser.add_argument("--output_json", help="Path to .idml file")
+    parser.add_argument("--verbose", action="store_true", help="Log per-item processing details")
     args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(message)s", stream=sys.stdout)
     idml_file = args.idml_file
     output_file_path = args.output_json
     extract(idml_file=idml_file,output_file_path=output_file_path)
     pass
 
+def collect_spreads(zf, idml_file, spread_files, story_paths):
+    # Spread results in file order, plus the story cache their frames resolve against (see resolve_story_texts). Several
+    # spreads go to a process pool whose workers open the package themselves (see worker_idml); a single one is walked
+    # in-process on zf. Only stories some frame references are parsed, each once, in threads (each with its own package
+    # handle, see open_story_idml) while later spreads are walked.
+    log_level = logging.getLogger().getEffectiveLevel()
+    spread_pool = concurrent.futures.ProcessPoolExecutor() if len(spread_files) > 1 else None
+    if spread_pool is None: spread_results = [collect_spread(zf, spread_files[0], log_level)]
+    else: # Forks the workers before any story thread starts
+        spread_results = spread_pool.map(functools.partial(process_spread_file, idml_path=idml_file, log_level=log_level), spread_files)
+    story_cache = {}; collected = []; story_handles = []
+    with contextlib.ExitStack() as stack:
+        if spread_pool is not None: stack.enter_context(spread_pool)
+        stack.callback(lambda: [h.close() for h in story_handles]) # After the story threads are joined
+        story_pool = stack.enter_context(concurrent.futures.ThreadPoolExecutor(
+            max_workers=8, initializer=open_story_idml, initargs=(idml_file, story_handles))) # Shut down (and joined) first
+        for result in spread_results:
+            collected.append(result)
+            submit_story_texts(result[0], story_cache, story_pool, story_paths)
+    return collected, story_cache
+
 def extract(idml_file,output_file_path):
-    temp_dir_base = os.path.join(tempfile.gettempdir(), "idml_extractor_debug")
-    os.makedirs(temp_dir_base, exist_ok=True)
-    temp_dir = tempfile.mkdtemp(prefix="idml_", dir=temp_dir_base)
-    print(f"⏳ Extracting '{idml_file}' to: {temp_dir}")
-    if not extract_idml(idml_file, temp_dir):
-        if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
-        return
-    spreads_dir = os.path.join(temp_dir, "Spreads"); stories_dir = os.path.join(temp_dir, "Stories")
-    if not os.path.isdir(spreads_dir):
-        print(f"❌ Critical: 'Spreads' folder missing at '{spreads_dir}'.")
-        if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
-        return
+    # Members are read straight from the package, which stays open only while the spreads and stories are collected
+    print(f"⏳ Reading: {idml_file}")
+    try: zf = zipfile.ZipFile(idml_file, 'r')
+    except Exception as e: print(f"❌ Reading IDML package failed: {e}"); return
+    with zf:
+        member_names = zf.namelist()
+        if not any(n.startswith(SPREADS_PREFIX) for n in member_names):
+            print(f"❌ Critical: 'Spreads' folder missing from '{idml_file}'.")
+            return
+        story_paths = find_story_paths(member_names)
+        spread_files = find_spread_files(member_names)
+        if not spread_files:
+            print(f"❌ No spread files found in {idml_file}.")
+            return
+        spread_results, story_cache = collect_spreads(zf, idml_file, spread_files, story_paths)
     all_page_data_by_id = {}
-    story_cache = {} 
     all_page_geometries = {}
-    spread_files = find_spread_files(spreads_dir)
-    if not spread_files:
-        print(f"❌ No spread files found in {spreads_dir}.")
-        if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
-        return
-    for spread_file_path in spread_files:
+    for spread_file_path, (content_from_this_spread, geoinfo_from_this_spread, spread_log) in zip(spread_files, spread_results):
         spread_name = os.path.basename(spread_file_path)
         print(f"\n📄 Processing Spread File: {spread_name}")
-        content_from_this_spread, geoinfo_from_this_spread = get_page_content_from_spread(spread_file_path, stories_dir, story_cache)
+        sys.stdout.write(spread_log)
+        resolve_story_texts(content_from_this_spread, story_cache)
         
         for page_info in geoinfo_from_this_spread: # Store geometry info
             if page_info.id not in all_page_geometries:
                 all_page_geometries[page_info.id] = page_info
                 
         for pid, pdata_in_spread in content_from_this_spread.items():
+            pid = sys.intern(pid) # Pool results carry their own copies of the id strings
             if pid not in all_page_data_by_id: all_page_data_by_id[pid] = pdata_in_spread
             else: 
+                existing = all_page_data_by_id[pid]
                 for img_item in pdata_in_spread["images"]:
-                    if not any(ex_img['uri']==img_item['uri'] and ex_img['image_element_id']==img_item['image_element_id'] for ex_img in all_page_data_by_id[pid]["images"]):
-                        all_page_data_by_id[pid]["images"].append(img_item)
-                current_tf_ids = {t['text_frame_id'] for t in all_page_data_by_id[pid]["texts"]}
+                    key = (img_item.uri, img_item.image_element_id)
+                    if key not in existing["_image_keys"]:
+                        existing["images"].append(img_item); existing["_image_keys"].add(key)
                 for text_item in pdata_in_spread["texts"]:
-                    if text_item['text_frame_id'] not in current_tf_ids:
-                        all_page_data_by_id[pid]["texts"].append(text_item); current_tf_ids.add(text_item['text_frame_id'])
+                    if text_item.text_frame_id not in existing["_text_ids"]:
+                        existing["texts"].append(text_item); existing["_text_ids"].add(text_item.text_frame_id)
+    # --- Report and build JSON output in one pass over the pages ---
     print("\n\n--- ✨ Consolidated Content Per Page ✨ ---")
     if not all_page_data_by_id: print("No content found on any pages.")
-    else:
-        final_sorted_page_ids = sorted(all_page_data_by_id.keys(), key=lambda pid_key: all_page_data_by_id[pid_key]["name"])
-        for pid in final_sorted_page_ids:
-            pdata = all_page_data_by_id[pid]; 
-            print(f"\n--- Page \"{pdata['name']}\" (ID: {pid}) ---")
-            page_geo_info = all_page_geometries.get(pid) # Get geometry info for this page
-            if not page_geo_info:
-                print(f"⚠️ Warning: Geometry info not found for Page ID {pid}. Skipping coordinate conversion for this page.")
-                page_offset_x, page_offset_y = 0, 0
-            else:
-                page_global_bounds = page_geo_info.global_aabb
-                page_offset_x = page_global_bounds["x1"]
-                page_offset_y = page_global_bounds["y1"]
-                
-            if pdata["texts"]:
-                print("📝 Texts:")
-                for t_item in pdata["texts"]:
-                    cp = (t_item['content'][:70] + '...') if len(t_item['content']) > 70 else t_item['content']
-                    b = t_item['global_bounds']
-                    # print(f"  - Story: {t_item['story_id']} (Frame: {t_item['text_frame_id']}) Bounds: x1={b['x1']:.1f},y1={b['y1']:.1f},x2={b['x2']:.1f},y2={b['y2']:.1f}")
-                    print(f"  - Story: {t_item['story_id']}")
-                    print(f"    Content: \"{cp.replace(chr(10), r'\\n')}\"")
-            else: print("📝 Texts: None")
-            if pdata["images"]:
-                print("🖼 Images:")
-                for img_item in pdata["images"]:
-                    b = img_item['global_bounds']
-                    print(f"  - URI: {img_item['uri']} (ImageElem: {img_item['image_element_id']}, Container: <{img_item['container_element_tag']} ID:{img_item['container_element_id']}>)")
-                    print(f"    Bounds: x1={b['x1']:.1f},y1={b['y1']:.1f},x2={b['x2']:.1f},y2={b['y2']:.1f}")
-            else: print("🖼 Images: None")
-    print("\n✅ Done. Cleaning up temporary directory...")
-    
-    # --- Prepare data for JSON output ---
     output_data = {"pages": []}
-    if all_page_data_by_id:
-        final_sorted_page_ids = sorted(all_page_data_by_id.keys(), 
-                                       key=lambda pid_key: all_page_data_by_id[pid_key]["name"])
-        for pid in final_sorted_page_ids:
-            pdata = all_page_data_by_id[pid]
-            
-            page_geo_info = all_page_geometries.get(pid)
-            if not page_geo_info:
-                print(f"⚠️ Warning: Geometry info not found for Page ID {pid}. Skipping coordinate conversion for this page.")
-                page_offset_x, page_offset_y = 0, 0
-            else:
-                page_global_bounds = page_geo_info.global_aabb
-                page_offset_x = page_global_bounds["x1"]
-                page_offset_y = page_global_bounds["y1"]
-                page_width = page_global_bounds["x2"] - page_global_bounds["x1"] 
-                page_height = page_global_bounds["y2"] - page_global_bounds["y1"] 
-                
-            page_output = {
-                "page_name": pdata["name"], # Using 'page_name' as key
-                "page_id": pid, # Also including the internal ID
-                "images": [],
-                "texts": []
-            }
-            for img_item in pdata["images"]:
-                item_global_bounds = img_item["global_bounds"]
-                page_output["images"].append({
-                    "URI": img_item["uri"],
-                    "ImageId": img_item['image_element_id'],
-                    "Bounds": { # Convert to page-relative coordinates
-                        "x1": item_global_bounds["x1"] - page_offset_x, "y1": item_global_bounds["y1"] - page_offset_y,
-                        "x2": item_global_bounds["x2"] - page_offset_x, "y2": item_global_bounds["y2"] - page_offset_y,
-                    },
-                    "page_width":page_width,
-                    "page_height":page_height
-                })
-            for t_item in pdata["texts"]:
-                item_global_bounds = t_item["global_bounds"]
-                page_output["texts"].append({
-                    "Content": t_item["content"],
-                    "TextId":t_item['text_frame_id'],
-                    "Bounds": { # Convert to page-relative coordinates
-                        "x1": item_global_bounds["x1"] - page_offset_x, "y1": item_global_bounds["y1"] - page_offset_y,
-                        "x2": item_global_bounds["x2"] - page_offset_x, "y2": item_global_bounds["y2"] - page_offset_y,
-                    },
-                    "page_width":page_width,
-                    "page_height":page_height
-                })
-            output_data["pages"].append(page_output)
+    for pid in sorted(all_page_data_by_id, key=lambda pid_key: all_page_data_by_id[pid_key]["name"]):
+        pdata = all_page_data_by_id[pid]
+        print(f"\n--- Page \"{pdata['name']}\" (ID: {pid}) ---")
+        page_geo_info = all_page_geometries.get(pid) # Get geometry info for this page
+        if not page_geo_info:
+            print(f"⚠️ Warning: Geometry info not found for Page ID {pid}. Skipping coordinate conversion for this page.")
+            page_offset_x, page_offset_y, page_width, page_height = 0, 0, 0, 0
+        else:
+            page_offset_x, page_offset_y, page_x2, page_y2 = page_geo_info.global_aabb
+            page_width = page_x2 - page_offset_x
+            page_height = page_y2 - page_offset_y
+        page_size = {"page_width":page_width, "page_height":page_height}
+        page_output = {
+            "page_name": pdata["name"], # Using 'page_name' as key
+            "page_id": pid, # Also including the internal ID
+            "images": [],
+            "texts": []
+        }
+        print("📝 Texts:" if pdata["texts"] else "📝 Texts: None")
+        for t_item in pdata["texts"]:
+            cp = (t_item.content[:70] + '...') if len(t_item.content) > 70 else t_item.content
+            print(f"  - Story: {t_item.story_id}")
+            print(f"    Content: \"{cp.replace(chr(10), r'\\n')}\"")
+            bx1, by1, bx2, by2 = t_item.global_bounds
+            page_output["texts"].append({
+                "Content": t_item.content,
+                "TextId":t_item.text_frame_id,
+                "Bounds": { # Convert to page-relative coordinates
+                    "x1": bx1 - page_offset_x, "y1": by1 - page_offset_y,
+                    "x2": bx2 - page_offset_x, "y2": by2 - page_offset_y,
+                },
+            } | page_size)
+        print("🖼 Images:" if pdata["images"] else "🖼 Images: None")
+        for img_item in pdata["images"]:
+            bx1, by1, bx2, by2 = img_item.global_bounds
+            print(f"  - URI: {img_item.uri} (ImageElem: {img_item.image_element_id}, Container: <{img_item.container_element_tag} ID:{img_item.container_element_id}>)")
+            print(f"    Bounds: x1={bx1:.1f},y1={by1:.1f},x2={bx2:.1f},y2={by2:.1f}")
+            page_output["images"].append({
+                "URI": img_item.uri,
+                "ImageId": img_item.image_element_id,
+                "Bounds": { # Convert to page-relative coordinates
+                    "x1": bx1 - page_offset_x, "y1": by1 - page_offset_y,
+                    "x2": bx2 - page_offset_x, "y2": by2 - page_offset_y,
+                },
+            } | page_size)
+        output_data["pages"].append(page_output)
+    print("\n✅ Done.")
 
     # --- Write to JSON file ---
     # json_file_path = 'output.json'
     try:
-        with open(output_file_path, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=4)
+        if orjson is not None:
+            with open(output_file_path, 'wb') as f: f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2))
+        else:
+            # Same 2-space layout as orjson's OPT_INDENT_2; json.dump writes the document in chunks as it encodes
+            with open(output_file_path, 'w', encoding='utf-8') as f: json.dump(output_data, f, ensure_ascii=False, indent=2)
         print(f"\n💾 Successfully wrote output to {output_file_path}")
     except IOError as e:
         print(f"\n❌ Error writing JSON to {output_file_path}: {e}")
-        
-    try: shutil.rmtree(temp_dir); print(f"🗑️ Temporary directory {temp_dir} removed.")
-    except Exception as e: print(f"⚠️ Error removing {temp_dir}: {e}. Please remove manually.")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file